@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from itertools import accumulate
+
+from load_test import percentile
+from shards import is_shard_path, read_documents
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "an", "el", "in", "or", "us", "ble", "tion", "ing", "er"]
+COMMON_WORDS = ["computer", "science", "software", "engineering", "machine", "learning", "research", "student",
+                "faculty", "informatics", "graduate", "course", "data", "systems", "network", "security"]
+DOMAINS = ["www.ics.uci.edu", "www.informatics.uci.edu", "cs.ics.uci.edu", "www.stat.uci.edu"]
+
+
+def make_vocabulary(rng, size):
+    words = list(COMMON_WORDS)
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def generate_corpus(directory, num_docs, seed=42, vocabulary_size=20000, duplicate_ratio=0.02):
+    """Write num_docs raw pages in the crawl's JSON shape ({"url", "content", "encoding"}).
+
+    Everything is drawn from random.Random(seed), so the same arguments
+    always produce byte-identical files. Words follow a Zipf distribution
+    mixed with words of a per-page topic, so pages are not near-duplicates of
+    each other. Links prefer low page numbers so PageRank has some skew, and a
+    small share of pages repeats an earlier page's content to exercise
+    duplicate detection.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng, vocabulary_size)
+    cumulative = list(accumulate(1 / rank ** 1.1 for rank in range(1, len(vocabulary) + 1)))
+
+    topic_size = 200
+    topic = 0
+
+    def words(count):
+        common = rng.choices(vocabulary, cum_weights=cumulative, k=count - count // 2)
+        topical = rng.choices(vocabulary[topic:topic + topic_size], k=count // 2)
+        mixed = common + topical
+        rng.shuffle(mixed)
+        return " ".join(mixed)
+
+    def url(page):
+        return f"https://{DOMAINS[page % len(DOMAINS)]}/bench/page{page}"
+
+    contents = []
+    for page in range(num_docs):
+        if contents and rng.random() < duplicate_ratio:
+            content = rng.choice(contents).replace("<title>", "<title>copy ", 1)
+        else:
+            topic = rng.randrange(len(vocabulary) - topic_size)
+            links = "".join(f'<a href="{url(int(num_docs * rng.random() ** 2))}">{words(2)}</a> '
+                            for _ in range(rng.randint(3, 20)))
+            paragraphs = "".join(f"<p>{words(rng.randint(20, 120))} <b>{words(2)}</b></p>"
+                                 for _ in range(rng.randint(1, 6)))
+            content = (f"<html><head><title>{words(rng.randint(2, 6))}</title></head><body>"
+                       f"<h1>{words(rng.randint(1, 4))}</h1><h2>{words(rng.randint(1, 5))}</h2>"
+                       f"{paragraphs}<div>{links}</div></body></html>")
+            contents.append(content)
+
+        domain_dir = os.path.join(directory, DOMAINS[page % len(DOMAINS)])
+        os.makedirs(domain_dir, exist_ok=True)
+        with open(os.path.join(domain_dir, f"{page:07d}.json"), "w") as f:
+            json.dump({"url": url(page), "content": content, "encoding": "utf-8"}, f)
+
+    return vocabulary, cumulative
+
+
+def make_workload(vocabulary, cumulative, num_queries, seed=42):
+    """Queries of 1-4 terms drawn from the corpus distribution, some of them repeated."""
+    rng = random.Random(seed + 1)
+    head = len(vocabulary) // 10  # queries lean towards the more frequent tenth of the vocabulary
+    queries = []
+    for _ in range(num_queries):
+        if queries and rng.random() < 0.2:
+            queries.append(rng.choice(queries))
+        else:
+            queries.append(" ".join(rng.choices(vocabulary[:head], cum_weights=cumulative[:head],
+                                                k=rng.randint(1, 4))))
+    return queries
+
+
+def run_stage(workdir, log, *args):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, args[0]), *args[1:]],
+                   cwd=workdir, stdout=log, stderr=subprocess.STDOUT, check=True)
+    return time.perf_counter() - start
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        "queries": len(latencies),
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def measure_queries(queries_path):
+    """Runs inside the benchmark workspace: time search() over the workload, cold, warm and cached.
+
+    The warm pass runs with the result cache emptied, so it measures
+    evaluation with warm posting and page caches; only the cached pass reads
+    results back from the result cache.
+    """
+    with open(queries_path) as f:
+        queries = json.load(f)
+
+    from index_shards import ShardCoordinator, shard_count
+    start = time.perf_counter()
+    if shard_count():
+        searcher = ShardCoordinator()
+        clear_result_cache = searcher.clear_result_cache
+    else:
+        import query_processor
+        searcher = query_processor
+        clear_result_cache = query_processor.result_cache.clear
+    load_time = time.perf_counter() - start
+
+    def result_cache_hits():
+        # Every query goes to every shard, so the hits of shard 0 count each query once
+        counters = searcher.cache_counters()
+        return counters.get("result_cache_hits", counters.get("shard0_result_cache_hits", 0))
+
+    passes = {}
+    for name in ("cold", "warm", "cached"):
+        if name == "warm":
+            clear_result_cache()
+        hits = result_cache_hits()
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            searcher.search(query, top_k=5)
+            latencies.append(time.perf_counter() - start)
+        passes[name] = dict(latency_summary(latencies), result_cache_hits=result_cache_hits() - hits)
+
+    if shard_count():
+        searcher.close()
+        print(json.dumps({"load_s": load_time, **passes}))
+        return
+
+    # search_batch must rank exactly like search(); the result cache is emptied
+    # so that the batch evaluates its queries instead of reading them back
+    batch = queries[:query_processor.MAX_BATCH_SIZE]
+    expected = [query_processor.search(query, top_k=5) for query in batch]
+    query_processor.result_cache.clear()
+    if query_processor.search_batch(batch, top_k=5) != expected:
+        sys.exit("search_batch results differ from search()")
+
+    print(json.dumps({"load_s": load_time, **passes}))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def count_processed(data_dir):
+    shard_dir = os.path.join(data_dir, "shards")
+    if is_shard_path(shard_dir):
+        return sum(1 for _ in read_documents(shard_dir, sections=()))
+    return len(os.listdir(os.path.join(data_dir, "processed_files")))
+
+
+def run_benchmark(workdir, num_docs, num_queries, seed, workers, page_processor_args, indexer_args):
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": {"docs": num_docs, "seed": seed, "queries": num_queries},
+        "stages": {},
+    }
+    stages = results["stages"]
+    raw_dir = os.path.join(workdir, "raw")
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+
+    start = time.perf_counter()
+    vocabulary, cumulative = generate_corpus(raw_dir, num_docs, seed)
+    stages["generate"] = {"seconds": time.perf_counter() - start}
+
+    with open(os.path.join(workdir, "benchmark.log"), "w") as log:
+        seconds = run_stage(workdir, log, "page_processor.py", raw_dir, "--workers", str(workers), *page_processor_args)
+        processed = count_processed(os.path.join(workdir, "data"))
+        stages["page_processor"] = {"seconds": seconds, "docs": processed, "docs_per_s": num_docs / seconds}
+
+        seconds = run_stage(workdir, log, "indexer.py", *indexer_args)
+        data_dir = os.path.join(workdir, "data")
+        index_bytes = {name: os.path.getsize(os.path.join(data_dir, name))
+                       for name in sorted(os.listdir(data_dir))
+                       if name.startswith(("diskdict", "positions", "doctable", "term_bounds", "idf_values"))}
+        stages["indexer"] = {"seconds": seconds, "docs_per_s": processed / seconds,
+                             "index_bytes": sum(index_bytes.values()), "files": index_bytes}
+
+        stages["pagerank"] = {"seconds": run_stage(workdir, log, "pagerank.py")}
+        stages["top_k_words"] = {"seconds": run_stage(workdir, log, "top_k_words.py")}
+
+        queries_path = os.path.join(workdir, "queries.json")
+        with open(queries_path, "w") as f:
+            json.dump(make_workload(vocabulary, cumulative, num_queries, seed), f)
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure-queries", queries_path],
+                                cwd=workdir, stdout=subprocess.PIPE, stderr=log, text=True, check=True).stdout
+        stages["search"] = json.loads(output.strip().splitlines()[-1])
+
+    results["data_bytes"] = directory_size(os.path.join(workdir, "data"))
+    return results
+
+
+def compare(results, baseline):
+    """Print every numeric metric next to the baseline's, with the ratio."""
+    def flatten(value, prefix=""):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                yield from flatten(item, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield prefix[:-1], value
+
+    old = dict(flatten(baseline.get("stages", {})))
+    for name, value in flatten(results["stages"]):
+        if name in old and old[name]:
+            print(f"{name:45s} {old[name]:14.3f} -> {value:14.3f}  x{value / old[name]:.2f}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build a synthetic corpus end to end and report stage timings as JSON")
+    parser.add_argument('--docs', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=1, help='page_processor.py worker processes')
+    parser.add_argument('--page-processor-args', default='', help='extra arguments for page_processor.py, e.g. --page-processor-args=--shards')
+    parser.add_argument('--indexer-args', default='', help='extra arguments for indexer.py, e.g. --indexer-args=--single-pass '
+                             '(with "=", since the value starts with a dash)')
+    parser.add_argument('--workdir', help='directory to build in (default: a temporary directory, removed afterwards)')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--measure-queries', metavar='QUERIES_JSON', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure_queries:
+        measure_queries(args.measure_queries)
+        sys.exit()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="search-benchmark-")
+    try:
+        results = run_benchmark(workdir, args.docs, args.queries, args.seed, args.workers,
+                                args.page_processor_args.split(), args.indexer_args.split())
+    except subprocess.CalledProcessError as e:
+        sys.exit(f"{os.path.basename(e.cmd[1])} failed, see {os.path.join(workdir, 'benchmark.log')}")
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,162 @@
+import os
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+import orjson
+from tqdm import tqdm
+
+from diskdict import DiskDict
+from postings import posting_count
+from text_processor import STEM_TABLE_PATH
+
+COMPLETIONS_PATH = 'data/completions.json'
+TOP_N = 10  # suggestions kept per precomputed prefix
+SCAN_LIMIT = 256  # prefixes matching more keys than this get a precomputed top-N
+MIN_DF = 2  # terms in fewer documents (ids, hashes, typos) are never suggested
+LAST_TOKEN_PATTERN = re.compile(r"[a-zA-Z0-9]+$")
+
+
+def document_frequencies(dbs, min_df=MIN_DF):
+    """stem -> df summed over the indexes (index shards hold disjoint documents), for terms in at least min_df documents."""
+    counts = Counter()
+    for db in dbs:
+        if db.lexicon:
+            counts.update(dict(zip(db.lexicon, db.lexicon.entries["df"].tolist())))
+            continue
+        for term in tqdm(db.disk_index, desc="Reading document frequencies"):
+            counts[term] += posting_count(db.get_bytes(term))
+    return {term: df for term, df in counts.items() if df >= min_df}
+
+
+def surface_forms(stems, stem_table):
+    """stem -> the surface words seen for it; a stem the table does not cover stands for itself."""
+    forms = defaultdict(list)
+    for word, stem in stem_table.items():
+        if stem in stems:
+            forms[stem].append(word)
+    for stem in stems:
+        if stem not in forms:
+            forms[stem].append(stem)
+    return forms
+
+
+def representative(stem, words):
+    """The stem itself when it is a word, else its shortest surface form."""
+    return stem if stem in words else min(words, key=lambda word: (len(word), word))
+
+
+class Completions:
+    """Prefix completion over the surface forms of the indexed terms, ranked by df.
+
+    Keys are the surface words, sorted; every key points to its stem. A prefix
+    matches a contiguous range of keys, found by binary search. Ranges larger
+    than SCAN_LIMIT have their top-N precomputed, so a lookup never scans more
+    than SCAN_LIMIT keys. A stem is suggested once, as its representative form
+    when that matches the prefix, otherwise as its first matching key.
+    """
+
+    def __init__(self, keys, key_stems, stem_df, stem_forms, top):
+        self.keys = keys
+        self.key_stems = np.asarray(key_stems, dtype=np.int64)
+        self.stem_df = np.asarray(stem_df, dtype=np.int64)
+        self.stem_forms = stem_forms
+        self.top = top
+
+    @classmethod
+    def build(cls, dbs, stem_table, min_df=MIN_DF, top_n=TOP_N, scan_limit=SCAN_LIMIT):
+        df = document_frequencies(dbs, min_df)
+        stems = sorted(df)
+        stem_ids = {stem: stem_id for stem_id, stem in enumerate(stems)}
+        forms = surface_forms(df, stem_table)
+
+        pairs = sorted((word, stem_ids[stem]) for stem, words in forms.items() for word in words)
+        completions = cls([word for word, _ in pairs], [stem_id for _, stem_id in pairs],
+                          [df[stem] for stem in stems],
+                          [representative(stem, forms[stem]) for stem in stems], {})
+
+        # Walk the implicit trie over the sorted keys, descending only into
+        # ranges too large to scan at query time
+        pending = [("", 0, len(completions.keys))]
+        while pending:
+            prefix, lo, hi = pending.pop()
+            depth = len(prefix)
+            start = lo
+            while start < hi:
+                key = completions.keys[start]
+                if len(key) <= depth:
+                    start += 1
+                    continue
+                child = key[:depth + 1]
+                end = completions._range_end(child, start, hi)
+                if end - start > scan_limit:
+                    completions.top[child] = completions._rank(child, start, end, top_n)
+                    pending.append((child, start, end))
+                start = end
+        return completions
+
+    def _range_end(self, prefix, lo, hi):
+        # Keys are plain alphanumerics, so every key with the prefix sorts below prefix + "\x7f"
+        return bisect_left(self.keys, prefix + "\x7f", lo, hi)
+
+    def _rank(self, prefix, lo, hi, limit):
+        """Key indexes of the top stems in keys[lo:hi], one display key per stem."""
+        key_stems = self.key_stems[lo:hi]
+        order = np.lexsort((np.arange(hi - lo), -self.stem_df[key_stems]))
+
+        chosen = {}
+        for position, stem_id in zip(order.tolist(), key_stems[order].tolist()):
+            if stem_id not in chosen:
+                if len(chosen) == limit:
+                    break
+                chosen[stem_id] = lo + position
+
+        display = []
+        for stem_id, key_index in chosen.items():
+            form = self.stem_forms[stem_id]
+            if form.startswith(prefix):
+                key_index = bisect_left(self.keys, form, lo, hi)
+            display.append(key_index)
+        return display
+
+    def suggest(self, text, limit=TOP_N):
+        """Completions of the last word of text, each returned with the text before it."""
+        match = LAST_TOKEN_PATTERN.search(text)
+        if not match:
+            return []
+        prefix = match.group().lower()
+        head = text[:match.start()]
+
+        indexes = self.top.get(prefix)
+        if indexes is None:
+            lo = bisect_left(self.keys, prefix)
+            hi = self._range_end(prefix, lo, len(self.keys))
+            indexes = self._rank(prefix, lo, hi, limit) if hi > lo else []
+        return [head + self.keys[index] for index in indexes[:limit]]
+
+    def save(self, path=COMPLETIONS_PATH):
+        Path(path).write_bytes(orjson.dumps({
+            "keys": self.keys, "key_stems": self.key_stems.tolist(), "stem_df": self.stem_df.tolist(),
+            "stem_forms": self.stem_forms, "top": self.top,
+        }))
+
+    @classmethod
+    def load(cls, path=COMPLETIONS_PATH):
+        data = orjson.loads(Path(path).read_bytes())
+        return cls(data["keys"], data["key_stems"], data["stem_df"], data["stem_forms"], data["top"])
+
+
+def build_completions(filenames=("diskdict",)):
+    stem_table = orjson.loads(Path(STEM_TABLE_PATH).read_bytes()) if os.path.exists(STEM_TABLE_PATH) else {}
+    dbs = [DiskDict(filename, read_only=True) for filename in filenames]
+    completions = Completions.build(dbs, stem_table)
+    for db in dbs:
+        db.close()
+    completions.save()
+    print(f"Completions: {len(completions.keys)} words, {len(completions.top)} precomputed prefixes")
+
+
+if __name__ == '__main__':
+    build_completions()
@@ -4,13 +4,35 @@ from pathlib import Path
 from collections import defaultdict
 from tqdm import tqdm
 import io
-from functools import lru_cache
+import mmap
+from itertools import count
+import numpy as np
+from postings import encode_postings, decode_postings, decode_columns, decode_arrays
+from metrics import metrics
+from lexicon import Lexicon
+from posting_cache import posting_cache
+
+# Approximate memory of a decoded posting: two tuple slots plus an int and a
+# float object for columns, 16 bytes of array data for arrays
+COLUMN_POSTING_BYTES = 2 * 8 + 28 + 24
+ARRAY_POSTING_BYTES = 8 + 8
+CACHE_ENTRY_OVERHEAD = 300
+_cache_owners = count()
 
 class DiskDict:
-    def __init__(self, filename="diskdict"):
+    def __init__(self, filename="diskdict", read_only=False, quantized=True):
+        self.cache_owner = next(_cache_owners)
         self.data_file_path = "data/" + filename + ".dat"
         self.index_file_path = "data/" + filename + ".idx"
-        
+        self.lexicon_path = "data/" + filename + ".lex"
+        self.lexicon = None
+        self.read_only = read_only
+        self.quantized = quantized
+
+        if read_only:
+            self._open_read_only()
+            return
+
         self.data_file_write = open(self.data_file_path, "ab", buffering=io.DEFAULT_BUFFER_SIZE)
         self.data_file_read = open(self.data_file_path, "rb", buffering=io.DEFAULT_BUFFER_SIZE)
         self.disk_index = {}
@@ -22,6 +44,30 @@ class DiskDict:
         self.memory_size = 0  
         self.MEMORY_LIMIT = 100 * 1024 * 1024  # 100 MB
 
+    def _open_read_only(self):
+        # Lookups slice a shared memory map instead of seek()+read() on one
+        # file object, so concurrent get() calls need no lock and no copy.
+        with open(self.data_file_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                self.data_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.data_view = memoryview(self.data_map)
+            else:
+                self.data_map = None
+                self.data_view = memoryview(b"")
+
+        self.disk_index = {}
+        if self._lexicon_is_current():
+            # Terms are looked up in the memory-mapped lexicon instead of a dict of the whole vocabulary
+            self.lexicon = self.disk_index = Lexicon(self.lexicon_path)
+        elif os.path.exists(self.index_file_path):
+            self._load_disk_index()
+
+    def _lexicon_is_current(self):
+        try:
+            return os.path.getmtime(self.lexicon_path) >= os.path.getmtime(self.index_file_path)
+        except FileNotFoundError:
+            return os.path.exists(self.lexicon_path)
+
     def _load_disk_index(self):
         json_bytes = Path(self.index_file_path).read_bytes()
         self.disk_index = orjson.loads(json_bytes)
@@ -31,6 +77,9 @@ class DiskDict:
         Path(self.index_file_path).write_bytes(json_bytes)
 
     def put(self, key, value):
+        if self.read_only:
+            raise IOError(f"{self.data_file_path} is opened read-only")
+
         value_bytes = orjson.dumps(value)
         self.memory_dict[key].append(value)
         self.memory_size += len(value_bytes) + len(str(key).encode())
@@ -39,7 +88,7 @@ class DiskDict:
             self._dump()
 
     def _dump(self, store_all=False):
-        if not self.memory_dict:
+        if not self.memory_dict and not store_all:
             return
 
         to_delete = []
@@ -49,10 +98,10 @@ class DiskDict:
                     if key in self.disk_index:
                         offset, length = self.disk_index[key]
                         self.data_file_read.seek(offset)
-                        old_values = orjson.loads(self.data_file_read.read(length).decode())
+                        old_values = decode_postings(self.data_file_read.read(length))
                         values = old_values + values
 
-                    value_bytes = orjson.dumps(values) + b"\n"
+                    value_bytes = encode_postings(values, quantized=self.quantized)
                     current_offset = self.data_file_write.tell()
                     self.data_file_write.write(value_bytes)
                     self.disk_index[key] = (current_offset, len(value_bytes))
@@ -66,16 +115,61 @@ class DiskDict:
         self._save_disk_index()
         self.memory_size = sum(len(orjson.dumps(v)) for values in self.memory_dict.values() for v in values)
 
-    @lru_cache(maxsize=1000)
-    def get(self, key):
+    def get_bytes(self, key):
         if key not in self.disk_index:
-            return []
+            return None
 
         offset, length = self.disk_index[key]
+        metrics.tally("bytes_read", length)
+        if self.read_only:
+            return self.data_view[offset:offset + length]
+
         self.data_file_read.seek(offset)
-        values = orjson.loads(self.data_file_read.read(length).decode())
+        return self.data_file_read.read(length)
+
+    def get_columns(self, key):
+        """(doc_ids, scores) tuples; lists of a read-only DiskDict go through the shared posting cache."""
+        cache_key = (self.cache_owner, "columns", key)
+        if self.read_only:
+            columns = posting_cache.get(cache_key)
+            if columns is not None:
+                return columns
+
+        value_bytes = self.get_bytes(key)
+        if value_bytes is None:
+            return (), ()
+
+        doc_ids, scores = decode_columns(value_bytes)
+        metrics.tally("postings_decoded", len(doc_ids))
+        # Cached columns are shared between queries, so they are immutable
+        columns = tuple(doc_ids), tuple(scores)
+        if self.read_only:
+            posting_cache.put(cache_key, columns, len(doc_ids) * COLUMN_POSTING_BYTES + CACHE_ENTRY_OVERHEAD)
+        return columns
+
+    def get_arrays(self, key):
+        """(doc_ids, scores) read-only NumPy arrays, cached like get_columns."""
+        cache_key = (self.cache_owner, "arrays", key)
+        if self.read_only:
+            arrays = posting_cache.get(cache_key)
+            if arrays is not None:
+                return arrays
+
+        value_bytes = self.get_bytes(key)
+        if value_bytes is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        doc_ids, scores = decode_arrays(value_bytes)
+        metrics.tally("postings_decoded", len(doc_ids))
+        # Cached arrays are shared between queries
+        doc_ids.flags.writeable = False
+        scores.flags.writeable = False
+        if self.read_only:
+            posting_cache.put(cache_key, (doc_ids, scores), len(doc_ids) * ARRAY_POSTING_BYTES + CACHE_ENTRY_OVERHEAD)
+        return doc_ids, scores
 
-        return values
+    def get(self, key):
+        return list(zip(*self.get_columns(key)))
 
     def _compactize(self):
         self.data_file_write.close()
@@ -100,16 +194,16 @@ class DiskDict:
         self.data_file_write = open(self.data_file_path, "ab", buffering=io.DEFAULT_BUFFER_SIZE)
         self.data_file_read = open(self.data_file_path, "rb", buffering=io.DEFAULT_BUFFER_SIZE)
 
-    def load_top_k_words_in_cache(self, k=800):
-        with open("data/top_k_words.txt", "r") as f:
-            for i, line in enumerate(f):
-                if i == k:
-                    break
-
-                word = line.strip()
-                self.get(word)
-
     def close(self):
+        if self.read_only:
+            posting_cache.discard(self.cache_owner)
+            self.data_view.release()
+            if self.data_map is not None:
+                self.data_map.close()
+            if self.lexicon is not None:
+                self.lexicon.close()
+            return
+
         self._dump(store_all=True)
         self.data_file_write.close()
         self.data_file_read.close()
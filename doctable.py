@@ -0,0 +1,105 @@
+import os
+import mmap
+import struct
+from pathlib import Path
+
+import numpy as np
+import orjson
+
+DOC_TABLE_PATH = 'data/doctable.bin'
+MAGIC = b"DTBL"
+VERSION = 1
+
+# Layout: header <4sII (magic, version, num_docs), then
+#   norms       float64[num_docs]
+#   page_ranks  float64[num_docs]
+#   url_offsets uint64[num_docs + 1]  into the UTF-8 url blob that follows
+_HEADER = struct.Struct("<4sII")
+
+
+def write_doc_table(num_docs, doc_norms, page_ranks, urls, path=DOC_TABLE_PATH):
+    """doc_norms, page_ranks and urls map doc_id -> value; missing ids get 0.0 / ''."""
+    norms = np.zeros(num_docs, dtype="<f8")
+    ranks = np.zeros(num_docs, dtype="<f8")
+    for doc_id, norm in doc_norms.items():
+        norms[doc_id] = norm
+    for doc_id, page_rank in page_ranks.items():
+        ranks[doc_id] = page_rank
+
+    encoded = [b""] * num_docs
+    for doc_id, url in urls.items():
+        encoded[doc_id] = url.encode()
+    offsets = np.zeros(num_docs + 1, dtype="<u8")
+    np.cumsum([len(url) for url in encoded], out=offsets[1:])
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, num_docs))
+        f.write(norms.tobytes())
+        f.write(ranks.tobytes())
+        f.write(offsets.tobytes())
+        f.write(b"".join(encoded))
+    os.replace(tmp_path, path)
+
+
+def update_page_ranks(page_ranks, path=DOC_TABLE_PATH):
+    """Overwrite the PageRank column in place; page_ranks maps doc_id -> score."""
+    with open(path, "r+b") as f:
+        _, _, num_docs = _read_header(f.read(_HEADER.size))
+        ranks = np.zeros(num_docs, dtype="<f8")
+        for doc_id, page_rank in page_ranks.items():
+            ranks[doc_id] = page_rank
+        f.seek(_HEADER.size + num_docs * 8)
+        f.write(ranks.tobytes())
+
+
+def _read_header(data):
+    magic, version, num_docs = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a version {VERSION} doc table")
+    return magic, version, num_docs
+
+
+def build_doc_table(with_page_ranks=True):
+    """Create the doc table from the JSON files written by indexer.py and pagerank.py."""
+    url_mapping = orjson.loads(Path('data/url_mapping.json').read_bytes())
+    urls = {doc_id: url for url, doc_id in url_mapping.items()}
+    doc_norms = {int(doc_id): norm for doc_id, norm in orjson.loads(Path('data/doc_norms.json').read_bytes()).items()}
+    num_docs = max(max(urls, default=-1), max(doc_norms, default=-1)) + 1
+
+    page_ranks = {}
+    if with_page_ranks and os.path.exists('data/url_mapping_with_pagerank.json'):
+        mapping = orjson.loads(Path('data/url_mapping_with_pagerank.json').read_bytes())
+        page_ranks = {doc_id: page_rank for doc_id, page_rank in mapping.values() if doc_id < num_docs}
+
+    write_doc_table(num_docs, doc_norms, page_ranks, urls)
+
+
+class DocTable:
+    """Memory-mapped, read-only view of the doc table with O(1) lookups by doc id."""
+
+    def __init__(self, path=DOC_TABLE_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        _, _, self.num_docs = _read_header(self.data_map)
+        offset = _HEADER.size
+        self.norms = np.frombuffer(self.data_map, dtype="<f8", count=self.num_docs, offset=offset)
+        offset += self.num_docs * 8
+        self.page_ranks = np.frombuffer(self.data_map, dtype="<f8", count=self.num_docs, offset=offset)
+        offset += self.num_docs * 8
+        self.url_offsets = np.frombuffer(self.data_map, dtype="<u8", count=self.num_docs + 1, offset=offset)
+        self.url_base = offset + (self.num_docs + 1) * 8
+
+    def __len__(self):
+        return self.num_docs
+
+    def url(self, doc_id):
+        start = self.url_base + int(self.url_offsets[doc_id])
+        end = self.url_base + int(self.url_offsets[doc_id + 1])
+        return self.data_map[start:end].decode()
+
+
+if __name__ == '__main__':
+    build_doc_table()
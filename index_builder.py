@@ -0,0 +1,124 @@
+import os
+import io
+import heapq
+import struct
+from array import array
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+
+import orjson
+from tqdm import tqdm
+
+from postings import encode_postings, decode_columns
+
+# Run record: <H term length> term <I postings length> postings
+_TERM_LEN = struct.Struct("<H")
+_BLOB_LEN = struct.Struct("<I")
+
+# Buffered postings live in two typed arrays per term, so their footprint is
+# known exactly; the per-term figure approximates the dict entry, key string
+# and the two array objects.
+POSTING_BYTES = array("I").itemsize + array("d").itemsize
+TERM_OVERHEAD = 250
+
+
+class IndexBuilder:
+    """Builds a DiskDict posting file from sorted runs and a final k-way merge.
+
+    Postings must be added in ascending doc id order. Whenever the buffer
+    reaches memory_limit it is written out as an immutable run sorted by
+    term; close() then merges all runs into data/<filename>.dat/.idx in a
+    single streaming pass, one term at a time.
+    """
+
+    def __init__(self, filename="diskdict", memory_limit=100 * 1024 * 1024, run_dir=None, quantized=True):
+        self.data_file_path = "data/" + filename + ".dat"
+        self.index_file_path = "data/" + filename + ".idx"
+        self.run_dir = run_dir or os.path.join("data/runs", filename)
+        self.memory_limit = memory_limit
+        self.quantized = quantized
+
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.run_paths = []
+        self.buffer = {}
+        self.memory_size = 0
+
+    def put(self, term, doc_id, score):
+        entry = self.buffer.get(term)
+        if entry is None:
+            entry = self.buffer[term] = (array("I"), array("d"))
+            self.memory_size += TERM_OVERHEAD + len(term)
+
+        entry[0].append(doc_id)
+        entry[1].append(score)
+        self.memory_size += POSTING_BYTES
+
+        if self.memory_size >= self.memory_limit:
+            self._write_run()
+
+    def _write_run(self):
+        if not self.buffer:
+            return
+
+        run_path = os.path.join(self.run_dir, f"run_{len(self.run_paths):05d}.bin")
+        with open(run_path, "wb", buffering=io.DEFAULT_BUFFER_SIZE * 16) as f:
+            for term in tqdm(sorted(self.buffer), desc=f"Writing {run_path}"):
+                doc_ids, scores = self.buffer[term]
+                term_bytes = term.encode()
+                blob = encode_postings(zip(doc_ids, scores), quantized=False)
+                f.write(_TERM_LEN.pack(len(term_bytes)) + term_bytes + _BLOB_LEN.pack(len(blob)) + blob)
+
+        self.run_paths.append(run_path)
+        self.buffer = {}
+        self.memory_size = 0
+
+    def close(self, transform=None):
+        """Flush the buffer and merge all runs into the final posting file.
+
+        transform(term, doc_ids, scores) may return the (doc_id, score) pairs
+        to store for a term, e.g. to apply IDF; an empty result drops the term.
+        """
+        self._write_run()
+        disk_index = {}
+
+        runs = [_read_run(path, run_no) for run_no, path in enumerate(self.run_paths)]
+        merged = heapq.merge(*runs)
+
+        # Written aside and swapped in, so a process still mapping the old file keeps reading it intact
+        tmp_path = self.data_file_path + ".tmp"
+        with open(tmp_path, "wb", buffering=io.DEFAULT_BUFFER_SIZE * 16) as data_file:
+            for term, records in tqdm(groupby(merged, key=itemgetter(0)), desc="Merging runs"):
+                # Runs hold consecutive doc id ranges, so concatenating them in
+                # run order keeps each posting list sorted.
+                doc_ids, scores = [], []
+                for _, _, blob in records:
+                    run_doc_ids, run_scores = decode_columns(blob)
+                    doc_ids.extend(run_doc_ids)
+                    scores.extend(run_scores)
+
+                postings = transform(term, doc_ids, scores) if transform else list(zip(doc_ids, scores))
+                if not postings:
+                    continue
+
+                value_bytes = encode_postings(postings, quantized=self.quantized)
+                disk_index[term] = (data_file.tell(), len(value_bytes))
+                data_file.write(value_bytes)
+
+        os.replace(tmp_path, self.data_file_path)
+        Path(self.index_file_path).write_bytes(orjson.dumps(disk_index))
+
+        for path in self.run_paths:
+            os.remove(path)
+        self.run_paths = []
+
+
+def _read_run(path, run_no):
+    with open(path, "rb", buffering=io.DEFAULT_BUFFER_SIZE * 16) as f:
+        while True:
+            header = f.read(_TERM_LEN.size)
+            if not header:
+                return
+            term = f.read(_TERM_LEN.unpack(header)[0]).decode()
+            blob_len = _BLOB_LEN.unpack(f.read(_BLOB_LEN.size))[0]
+            yield term, run_no, f.read(blob_len)
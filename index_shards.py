@@ -0,0 +1,253 @@
+import os
+import sys
+import time
+import threading
+import multiprocessing
+from heapq import nlargest
+from itertools import chain, count
+from operator import itemgetter
+from pathlib import Path
+
+import orjson
+
+from index_builder import IndexBuilder
+from lexicon import Lexicon, lexicon_path
+from posting_cache import POSTING_CACHE_BYTES
+from term_bounds import term_bounds_path
+from tiers import TIER_FILENAMES
+
+# Document-partitioned index: document doc_id goes to shard doc_id % N, whose
+# postings live in data/diskdict_shard<i>.dat/.idx/.lex. Doc ids, idf, norms
+# and PageRank stay global, so every shard scores its documents exactly as the
+# unsharded index would, and the global top-k is the best k of the shards'.
+SHARD_MANIFEST_PATH = 'data/index_shards.json'
+SHARD_ENV = 'SEARCH_SHARD'  # set in a worker process: query_processor opens that shard
+
+
+def shard_filename(shard):
+    return f"diskdict_shard{shard}"
+
+
+def shard_count():
+    """Number of index shards written by indexer.py --index-shards, 0 for an unsharded index."""
+    if not os.path.exists(SHARD_MANIFEST_PATH):
+        return 0
+    return orjson.loads(Path(SHARD_MANIFEST_PATH).read_bytes())["shards"]
+
+
+def write_shard_manifest(shards):
+    if shards:
+        Path(SHARD_MANIFEST_PATH).write_bytes(orjson.dumps({"shards": shards}))
+    elif os.path.exists(SHARD_MANIFEST_PATH):
+        os.remove(SHARD_MANIFEST_PATH)
+
+
+def remove_stale_indexes(shards):
+    """Delete the index files a build with a different layout left behind, so no reader picks them up.
+
+    A sharded build removes the unsharded index with its term bounds and
+    tiers; any build removes the shards of the previous manifest it does not
+    overwrite.
+    """
+    filenames = [shard_filename(shard) for shard in range(shards, shard_count())]
+    if shards:
+        filenames += ["diskdict"] + TIER_FILENAMES
+    paths = [term_bounds_path(filename) for filename in filenames]
+    for filename in filenames:
+        paths += ["data/" + filename + suffix for suffix in (".dat", ".idx", ".lex")]
+    if not shards:
+        paths.append(SHARD_MANIFEST_PATH)
+
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class ShardedIndexBuilder:
+    """One IndexBuilder per shard, splitting the memory limit between them; put() routes by doc id."""
+
+    def __init__(self, shards, memory_limit=100 * 1024 * 1024):
+        self.builders = [IndexBuilder(shard_filename(shard), memory_limit // shards) for shard in range(shards)]
+
+    def put(self, term, doc_id, score):
+        self.builders[doc_id % len(self.builders)].put(term, doc_id, score)
+
+    def close(self, transform=None):
+        for builder in self.builders:
+            builder.close(transform)
+
+
+class ShardedIdf:
+    """Global term -> idf read from the lexicons of all shards.
+
+    Every shard lexicon stores the global idf of the terms it contains, so a
+    term's idf is found in any shard that has it. A shard on its own would
+    miss the terms only other shards contain and get a different query norm.
+    """
+
+    def __init__(self, shards):
+        self.lexicons = [Lexicon(lexicon_path(shard_filename(shard))) for shard in range(shards)]
+        self.columns = [lexicon.entries["idf"] for lexicon in self.lexicons]
+
+    def get(self, term, default=None):
+        for lexicon, idf in zip(self.lexicons, self.columns):
+            ordinal = lexicon.ordinal(term)
+            if ordinal >= 0:
+                return idf[ordinal].item()
+        return default
+
+
+def _serve_shard(shard, connection, cache_bytes, query_log_path):
+    """Worker process: load one shard through query_processor and answer (method, args) requests."""
+    os.environ[SHARD_ENV] = str(shard)
+    from posting_cache import posting_cache
+    posting_cache.resize(cache_bytes)
+    posting_cache.query_log_path = query_log_path
+    import query_processor
+    query_processor.warm_posting_cache()
+
+    methods = {
+        "search": query_processor.search,
+        "search_batch": query_processor.search_batch,
+        "cache_counters": query_processor.cache_counters,
+        "cache_stats": lambda: dict(query_processor.result_cache.stats(), posting_cache=posting_cache.stats()),
+        "clear_result_cache": query_processor.result_cache.clear,
+    }
+    connection.send(query_processor.MAX_BATCH_SIZE)
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+
+        method, args = request
+        try:
+            connection.send(methods[method](*args))
+        except Exception as error:
+            connection.send(error)
+
+
+class ShardCoordinator:
+    """Scatter-gather search over worker processes that each load one shard.
+
+    A query is sent to every shard, each returns its local top-k as
+    (score, doc_id, url) and the coordinator keeps the best k overall, ties
+    broken by doc id like the unsharded search. Every worker connection has
+    its own lock, taken in shard order: a query is sent to a shard as soon as
+    that shard's worker is free, so concurrent queries overlap across shards.
+    With replicas > 1 each shard has several workers, used in turn.
+    """
+
+    def __init__(self, shards=None, replicas=1, cache_bytes=POSTING_CACHE_BYTES, query_log_path=None):
+        """cache_bytes is the posting cache budget of all workers together.
+
+        Every shard sees the same query terms, so only the workers of shard 0
+        append them to query_log_path.
+        """
+        shards = shards or shard_count()
+        if not shards:
+            raise FileNotFoundError(f"{SHARD_MANIFEST_PATH} not found; build the index with indexer.py --index-shards N")
+
+        context = multiprocessing.get_context("spawn")
+        self.workers = []  # per shard, its replicas as (connection, lock)
+        self.processes = []
+        for shard in range(shards):
+            replica_workers = []
+            for _ in range(replicas):
+                connection, worker_connection = context.Pipe()
+                process = context.Process(target=_serve_shard, daemon=True,
+                                          args=(shard, worker_connection, cache_bytes // (shards * replicas),
+                                                query_log_path if shard == 0 else None))
+                process.start()
+                worker_connection.close()
+                replica_workers.append((connection, threading.Lock()))
+                self.processes.append(process)
+            self.workers.append(replica_workers)
+        self.turns = [count() for _ in range(shards)]
+
+        # Each worker reports its batch limit once it has loaded its shard
+        self.max_batch_size = min(connection.recv() for replica_workers in self.workers
+                                  for connection, _ in replica_workers)
+
+    def _scatter(self, method, *args):
+        """Call method on one worker of every shard and return the shards' answers in shard order."""
+        chosen = [replica_workers[next(turn) % len(replica_workers)]
+                  for replica_workers, turn in zip(self.workers, self.turns)]
+        for connection, lock in chosen:
+            lock.acquire()
+            connection.send((method, args))
+
+        answers = []
+        for connection, lock in chosen:
+            try:
+                answers.append(connection.recv())
+            finally:
+                lock.release()
+
+        for answer in answers:
+            if isinstance(answer, Exception):
+                raise answer
+        return answers
+
+    def search(self, query, top_k=10):
+        return merge_top_k(self._scatter("search", query, top_k), top_k)
+
+    def search_batch(self, queries, top_k=10):
+        shard_results = self._scatter("search_batch", queries, top_k)
+        return [merge_top_k(query_results, top_k) for query_results in zip(*shard_results)]
+
+    def cache_stats(self):
+        return {"shards": self._scatter("cache_stats")}
+
+    def cache_counters(self):
+        counters = {}
+        for shard, shard_counters in enumerate(self._scatter("cache_counters")):
+            for name, value in shard_counters.items():
+                counters[f"shard{shard}_{name}"] = value
+        return counters
+
+    def clear_result_cache(self):
+        """Empty the result cache of every worker, replicas included."""
+        for replica_workers in self.workers:
+            for connection, lock in replica_workers:
+                with lock:
+                    connection.send(("clear_result_cache", ()))
+                    answer = connection.recv()
+                if isinstance(answer, Exception):
+                    raise answer
+
+    def close(self):
+        for replica_workers in self.workers:
+            for connection, lock in replica_workers:
+                with lock:
+                    connection.send(None)
+                    connection.close()
+        for process in self.processes:
+            process.join()
+
+
+def merge_top_k(shard_results, top_k):
+    return nlargest(top_k, chain.from_iterable(shard_results), key=itemgetter(0, 1))
+
+
+if __name__ == '__main__':
+    coordinator = ShardCoordinator(int(sys.argv[1]) if len(sys.argv) > 1 else None)
+    print(f"Searching {len(coordinator.workers)} index shards...")
+    try:
+        while True:
+            query = input("Please enter your query: ")
+
+            start_time = time.time()
+            top_results = coordinator.search(query, top_k=5)
+            end_time = time.time()
+
+            print("\nTop results:")
+            for score, doc_id, url in top_results:
+                print(f"Doc ID: {doc_id}, URL: {url}, Similarity: {score:.4f}")
+            print(f"Elapsed time: {(end_time - start_time) * 1000:.2f} ms")
+
+    except (KeyboardInterrupt, EOFError):
+        print("Exiting...")
+        coordinator.close()
@@ -1,14 +1,24 @@
 import os
 import json
+import argparse
 # from distdict import DistDict
-from diskdict import DiskDict
+from index_builder import IndexBuilder
+from term_bounds import build_term_bounds
+from doctable import build_doc_table
+from lexicon import build_lexicon
+from completion import build_completions
+from positions import PositionBuilder
+from shards import SECTIONS, corpus_path, is_shard_path, read_documents
+from index_shards import ShardedIndexBuilder, remove_stale_indexes, shard_filename, write_shard_manifest
 from collections import defaultdict
 import math
 from tqdm import tqdm
 import orjson
 from pathlib import Path
 
-db = DiskDict()
+db = None  # IndexBuilder, or ShardedIndexBuilder with --index-shards; created in __main__
+positions = None  # PositionBuilder when run with --positions
+DOC_STATS_PATH = "data/doc_stats.jsonl"
 
 WEIGHTS = {
     "title": 5.0,
@@ -25,31 +35,22 @@ WEIGHTS = {
 def document_generator(folder_path):
     global urls
     urls = defaultdict(int)
-    doc_id = 0
+    documents = read_documents(folder_path) if is_shard_path(folder_path) else read_processed_files(folder_path)
 
+    for doc_id, (url, sections) in enumerate(documents):
+        urls[url] = doc_id
+        yield doc_id, sections
+
+def read_processed_files(folder_path):
     for filename in os.listdir(folder_path):
         file_path = os.path.join(folder_path, filename)
         if os.path.isfile(file_path) and filename.endswith(".json"):
             with open(file_path, 'r', encoding='utf-8') as file:
                 data = json.load(file)
+                yield data.get("url", ""), document_sections(data)
 
-                url = data.get("url", "")
-                urls[url] = doc_id
-                
-                sections = {
-                    "title": data.get("title", []),
-                    "bold": data.get("bold", []),
-                    "h1": data.get("h1", []),
-                    "h2": data.get("h2", []),
-                    "h3": data.get("h3", []),
-                    "h4": data.get("h4", []),
-                    "h5": data.get("h5", []),
-                    "h6": data.get("h6", []),
-                    "other_text": data.get("other_text", [])
-                }
-
-                yield doc_id, sections
-                doc_id += 1 
+def document_sections(data):
+    return {section: data.get(section, []) for section in SECTIONS}
 
 def compute_df_idf(document_generator):
     df_counts = defaultdict(int)
@@ -98,6 +99,8 @@ def compute_tf_idf(document_generator, idf_dict, total_docs):
         }
 
         create_inverted_index(doc_id, tfidf_scores)
+        if positions:
+            positions.add_document(doc_id, sections)
 
         doc_norms[str(doc_id)] = math.sqrt(sum(score ** 2 for score in tfidf_scores.values()))
     
@@ -107,15 +110,85 @@ def compute_tf_idf(document_generator, idf_dict, total_docs):
 def create_inverted_index(doc_id, tfidf_scores):
     for term, value in tfidf_scores.items():
         if value > 0:
-            db.put(term, (doc_id, f"{value:.4f}"))
+            db.put(term, doc_id, value)
+
+def compute_tf_single_pass(document_generator):
+    """Read the corpus once, storing raw weighted TF postings and per-document TF vectors."""
+    df_counts = defaultdict(int)
+    total_docs = 0
+
+    with open(DOC_STATS_PATH, "wb") as doc_stats:
+        for doc_id, sections in tqdm(document_generator(), desc="Computing TF"):
+            tf = compute_tf(sections)
+
+            for term, value in tf.items():
+                db.put(term, doc_id, value)
+                df_counts[term] += 1
+            if positions:
+                positions.add_document(doc_id, sections)
+
+            doc_stats.write(orjson.dumps([doc_id, list(tf.items())]) + b"\n")
+            total_docs += 1
+
+    return df_counts, total_docs
+
+def finalize_single_pass(df_counts, total_docs):
+    """Compute doc norms and apply IDF while merging the raw TF runs, without touching the corpus."""
+    idf_dict = {term: math.log10(total_docs / df) for term, df in df_counts.items()}
+    Path('data/idf_values.json').write_bytes(orjson.dumps(idf_dict))
+
+    # Same summation order as compute_tf_idf, so the norms come out identical
+    doc_norms = {}
+    with open(DOC_STATS_PATH, "rb") as doc_stats:
+        for line in tqdm(doc_stats, desc="Computing doc norms", total=total_docs):
+            doc_id, tf_items = orjson.loads(line)
+            doc_norms[str(doc_id)] = math.sqrt(sum((tf * idf_dict.get(term, 0)) ** 2 for term, tf in tf_items))
+    Path('data/doc_norms.json').write_bytes(orjson.dumps(doc_norms))
+
+    def apply_idf(term, doc_ids, tfs):
+        idf = idf_dict[term]
+        postings = [(doc_id, tf * idf) for doc_id, tf in zip(doc_ids, tfs)]
+        return [(doc_id, value) for doc_id, value in postings if value > 0]
+
+    db.close(transform=apply_idf)
+    os.remove(DOC_STATS_PATH)
 
 if __name__ == '__main__':
-    folder_path = "data/processed_files"
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--single-pass', action='store_true', help='read the corpus only once')
+    parser.add_argument('--positions', action='store_true', help='also write a positional index')
+    parser.add_argument('--index-shards', type=int, default=0,
+                        help='partition the documents into this many index shards (see index_shards.py)')
+    args = parser.parse_args()
+
+    folder_path = corpus_path()
     global urls
 
-    idf_dict, total_docs = compute_df_idf(lambda: document_generator(folder_path))
-    compute_tf_idf(lambda: document_generator(folder_path), idf_dict, total_docs)
+    if args.positions:
+        positions = PositionBuilder()
+
+    remove_stale_indexes(args.index_shards)
+    if args.index_shards:
+        db = ShardedIndexBuilder(args.index_shards)
+        filenames = [shard_filename(shard) for shard in range(args.index_shards)]
+    else:
+        db = IndexBuilder()
+        filenames = ["diskdict"]
+
+    if args.single_pass:
+        df_counts, total_docs = compute_tf_single_pass(lambda: document_generator(folder_path))
+        finalize_single_pass(df_counts, total_docs)
+    else:
+        idf_dict, total_docs = compute_df_idf(lambda: document_generator(folder_path))
+        compute_tf_idf(lambda: document_generator(folder_path), idf_dict, total_docs)
+        db.close()
 
-    db.close()
+    if positions:
+        positions.close()
 
     Path('data/url_mapping.json').write_bytes(orjson.dumps(urls))
+    for filename in filenames:
+        build_lexicon(filename, build_term_bounds(filename))
+    write_shard_manifest(args.index_shards)
+    build_completions(filenames)
+    build_doc_table(with_page_ranks=False)
@@ -0,0 +1,265 @@
+import os
+import sys
+import mmap
+import struct
+from bisect import bisect_right
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import orjson
+from tqdm import tqdm
+
+from postings import posting_count
+
+# Lexicon file layout (all integers little-endian):
+#
+#   header   <4sBxHQQ  magic, version, terms per block, term count, block count
+#   entries  count * ENTRY_DTYPE    posting offset/length, df, idf and max impact, in term order
+#   blocks   block count * <u8      offset of every term block within the term data
+#   terms    sorted terms, front-coded in blocks of BLOCK_SIZE: the first term of a
+#            block is stored whole (varint length + bytes), every other one as varint
+#            shared prefix length, varint suffix length and the suffix bytes
+#
+# Only the first term of every block is held in memory. A lookup binary
+# searches those, then decodes at most one block; the entries are read from
+# the memory map.
+FORMAT_VERSION = 1
+MAGIC = b"LEXN"
+BLOCK_SIZE = 16
+ORDINAL_CACHE_SIZE = 65536
+ENTRY_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"), ("df", "<u4"), ("idf", "<f8"), ("max_impact", "<f8")])
+
+_HEADER = struct.Struct("<4sBxHQQ")
+
+
+def lexicon_path(filename="diskdict"):
+    return "data/" + filename + ".lex"
+
+
+def _varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return out
+
+
+def _read_varint(data, position):
+    byte = data[position]
+    if byte < 0x80:
+        return byte, position + 1
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def write_lexicon(path, disk_index, df, idf_values=None, max_impacts=None, block_size=BLOCK_SIZE):
+    """Write the lexicon of a term -> (offset, length) index; terms missing from idf_values or max_impacts get 0."""
+    idf_values = idf_values or {}
+    max_impacts = max_impacts or {}
+    terms = sorted(disk_index)
+
+    entries = np.zeros(len(terms), dtype=ENTRY_DTYPE)
+    term_data = bytearray()
+    block_offsets = []
+    previous = b""
+    for ordinal, term in enumerate(terms):
+        offset, length = disk_index[term]
+        entries[ordinal] = (offset, length, df[term], idf_values.get(term, 0.0), max_impacts.get(term, 0.0))
+
+        term_bytes = term.encode()
+        if ordinal % block_size == 0:
+            block_offsets.append(len(term_data))
+            term_data += _varint(len(term_bytes)) + term_bytes
+        else:
+            shared = 0
+            limit = min(len(previous), len(term_bytes))
+            while shared < limit and previous[shared] == term_bytes[shared]:
+                shared += 1
+            term_data += _varint(shared) + _varint(len(term_bytes) - shared) + term_bytes[shared:]
+        previous = term_bytes
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, block_size, len(terms), len(block_offsets)))
+        f.write(entries.tobytes())
+        f.write(np.asarray(block_offsets, dtype="<u8").tobytes())
+        f.write(term_data)
+    os.replace(tmp_path, path)
+
+
+class Lexicon:
+    """Read-only, memory-mapped term dictionary.
+
+    It stands in for the term -> (offset, length) dict of a DiskDict
+    (in, [], get, len and sorted iteration), and adds the per-term df, idf and
+    max impact without touching the postings.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.block_size, self.num_terms, num_blocks = _HEADER.unpack_from(self.data_map)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} lexicon")
+
+        offset = _HEADER.size
+        self.entries = np.frombuffer(self.data_map, dtype=ENTRY_DTYPE, count=self.num_terms, offset=offset)
+        offset += self.entries.nbytes
+        terms_start = offset + num_blocks * 8
+        self.block_offsets = (np.frombuffer(self.data_map, dtype="<u8", count=num_blocks, offset=offset)
+                              + terms_start).tolist()
+
+        # The sparse in-memory index: the first term of every block
+        self.block_heads = []
+        for block_offset in self.block_offsets:
+            length, position = _read_varint(self.data_map, block_offset)
+            self.block_heads.append(self.data_map[position:position + length].decode())
+
+        self.ordinal = lru_cache(maxsize=ORDINAL_CACHE_SIZE)(self._ordinal)
+
+    def _block_terms(self, block):
+        """Yield the terms of a block as bytes, in order."""
+        data = self.data_map
+        length, position = _read_varint(data, self.block_offsets[block])
+        term = data[position:position + length]
+        position += length
+        yield term
+
+        count = min(self.block_size, self.num_terms - block * self.block_size) - 1
+        for _ in range(count):
+            shared = data[position]
+            length = data[position + 1]
+            if shared < 0x80 and length < 0x80:
+                position += 2
+            else:
+                shared, position = _read_varint(data, position)
+                length, position = _read_varint(data, position)
+            term = term[:shared] + data[position:position + length]
+            position += length
+            yield term
+
+    def _ordinal(self, term):
+        """Position of the term in sorted order, or -1 when it is not in the lexicon."""
+        block = bisect_right(self.block_heads, term) - 1
+        if block < 0:
+            return -1
+
+        target = term.encode()
+        for position, candidate in enumerate(self._block_terms(block)):
+            if candidate == target:
+                return block * self.block_size + position
+            if candidate > target:
+                break
+        return -1
+
+    def term(self, ordinal):
+        block, position = divmod(ordinal, self.block_size)
+        for index, term in enumerate(self._block_terms(block)):
+            if index == position:
+                return term.decode()
+
+    def entry(self, term):
+        """(offset, length, df, idf, max impact) of a term, or None."""
+        ordinal = self.ordinal(term)
+        if ordinal < 0:
+            return None
+        return self.entries[ordinal].item()
+
+    def __getitem__(self, term):
+        ordinal = self.ordinal(term)
+        if ordinal < 0:
+            raise KeyError(term)
+        entry = self.entries[ordinal]
+        return int(entry["offset"]), int(entry["length"])
+
+    def get(self, term, default=None):
+        ordinal = self.ordinal(term)
+        if ordinal < 0:
+            return default
+        entry = self.entries[ordinal]
+        return int(entry["offset"]), int(entry["length"])
+
+    def __contains__(self, term):
+        return self.ordinal(term) >= 0
+
+    def __len__(self):
+        return self.num_terms
+
+    def __iter__(self):
+        for block in range(len(self.block_offsets)):
+            for term in self._block_terms(block):
+                yield term.decode()
+
+    def keys(self):
+        return iter(self)
+
+    def column(self, name):
+        return LexiconColumn(self, name)
+
+    def close(self):
+        self.entries = None
+        self.ordinal.cache_clear()
+        try:
+            self.data_map.close()
+        except BufferError:
+            pass  # a column is still in use; the map is closed when it goes away
+
+
+class LexiconColumn:
+    """One per-term field of a lexicon as a read-only mapping, e.g. term -> idf."""
+
+    def __init__(self, lexicon, name):
+        self.lexicon = lexicon
+        self.values = lexicon.entries[name]
+
+    def get(self, term, default=None):
+        ordinal = self.lexicon.ordinal(term)
+        return default if ordinal < 0 else self.values[ordinal].item()
+
+    def __getitem__(self, term):
+        ordinal = self.lexicon.ordinal(term)
+        if ordinal < 0:
+            raise KeyError(term)
+        return self.values[ordinal].item()
+
+    def __contains__(self, term):
+        return self.lexicon.ordinal(term) >= 0
+
+
+def build_lexicon(filename="diskdict", max_impacts=None):
+    """Write data/<filename>.lex from the JSON .idx of a DiskDict, with df read from the posting headers.
+
+    idf comes from data/idf_values.json, when it exists, and the max impact
+    from max_impacts (as computed by term_bounds.py).
+    """
+    index_file_path = "data/" + filename + ".idx"
+    disk_index = orjson.loads(Path(index_file_path).read_bytes())
+
+    idf_values = orjson.loads(Path('data/idf_values.json').read_bytes()) if os.path.exists('data/idf_values.json') else {}
+
+    df = {}
+    with open("data/" + filename + ".dat", "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if disk_index else b""
+        for term, (offset, length) in tqdm(disk_index.items(), desc=f"Reading {filename} document frequencies"):
+            df[term] = posting_count(data[offset:offset + length])
+        if disk_index:
+            data.close()
+
+    write_lexicon(lexicon_path(filename), disk_index, df, idf_values, max_impacts)
+
+
+if __name__ == '__main__':
+    # Imported here: term_bounds imports diskdict, which imports this module
+    from term_bounds import stored_max_impacts
+    for filename in sys.argv[1:] or ["diskdict"]:
+        build_lexicon(filename, stored_max_impacts(filename))
@@ -0,0 +1,83 @@
+import argparse
+import json
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_QUERIES = [
+    "Iftekhar Ahmed",
+    "Machine Learning",
+    "ACM",
+    "Master of Software Engineering",
+    "computer science",
+    "informatics research",
+    "graduate admissions",
+    "software engineering faculty",
+]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def send_search(base_url, query):
+    url = f"{base_url}/search?q={urllib.parse.quote(query)}"
+    with urllib.request.urlopen(url) as response:
+        response.read()
+
+
+def send_batch(base_url, queries):
+    body = json.dumps({"queries": queries}).encode()
+    request = urllib.request.Request(f"{base_url}/search/batch", data=body,
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        response.read()
+
+
+def run(base_url, queries, requests, concurrency, batch_size):
+    def one_request(i):
+        start = time.perf_counter()
+        if batch_size > 1:
+            send_batch(base_url, [queries[(i * batch_size + j) % len(queries)] for j in range(batch_size)])
+        else:
+            send_search(base_url, queries[i % len(queries)])
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(executor.map(one_request, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "queries": requests * max(batch_size, 1),
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "requests_per_s": requests / elapsed,
+        "queries_per_s": requests * max(batch_size, 1) / elapsed,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+        },
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Send concurrent queries to server.py and report throughput")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--batch-size', type=int, default=1, help='queries per /search/batch request')
+    parser.add_argument('--queries', help='file with one query per line')
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    print(json.dumps(run(args.url, queries, args.requests, args.concurrency, args.batch_size), indent=2))
@@ -0,0 +1,183 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+import orjson
+
+# Upper bounds of the latency buckets, in milliseconds
+BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+SLOW_QUERY_LOG_PATH = 'data/slow_queries.jsonl'
+GAUGE_SUFFIXES = ("_ratio", "_entries", "_bytes")  # reported values that can go down
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given quantile."""
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return 0.0
+
+
+class QueryTrace:
+    """Stage timings and posting lengths of one query, collected on the thread answering it."""
+
+    def __init__(self, query):
+        self.query = query
+        self.stages = defaultdict(float)
+        self.posting_lengths = {}
+
+
+class Metrics:
+    """Process-wide counters and latency histograms.
+
+    Counters and histograms are updated under one lock; the work done while
+    holding it is a few additions, so instrumentation stays cheap next to
+    the stages it measures. Counts taken on every posting lookup go through
+    tally() instead, which adds to counters of the calling thread without
+    the lock; they are summed when metrics are reported.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.thread_counters = []  # (thread, its tally() counters) of the threads still running
+        self.histograms = defaultdict(Histogram)
+        self.local = threading.local()
+        self.slow_query_ms = None
+        self.slow_query_log_path = SLOW_QUERY_LOG_PATH
+        self.started = time.time()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def tally(self, name, value=1):
+        counters = getattr(self.local, "counters", None)
+        if counters is None:
+            counters = self.local.counters = defaultdict(int)
+            with self.lock:
+                self._fold_finished_threads()
+                self.thread_counters.append((threading.current_thread(), counters))
+        counters[name] += value
+
+    def _fold_finished_threads(self):
+        """Move the tallies of threads that have exited into the shared counters; called with the lock held."""
+        running = []
+        for thread, counters in self.thread_counters:
+            if thread.is_alive():
+                running.append((thread, counters))
+            else:
+                for name, value in counters.items():
+                    self.counters[name] += value
+        self.thread_counters = running
+
+    def observe(self, name, milliseconds):
+        with self.lock:
+            self.histograms[name].observe(milliseconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.observe("stage_" + name, elapsed)
+            trace = getattr(self.local, "trace", None)
+            if trace is not None:
+                trace.stages[name] += elapsed
+
+    @contextmanager
+    def query(self, query):
+        """Time a whole query and make its trace current for the stages run inside it."""
+        trace = self.local.trace = QueryTrace(query)
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.local.trace = None
+            self.observe("query", elapsed)
+            self.count("queries")
+            if self.slow_query_ms is not None and elapsed >= self.slow_query_ms:
+                self.count("slow_queries")
+                self._log_slow_query(trace, elapsed)
+
+    def record_postings(self, term, length):
+        trace = getattr(self.local, "trace", None)
+        if trace is not None:
+            trace.posting_lengths[term] = trace.posting_lengths.get(term, 0) + length
+
+    def _log_slow_query(self, trace, elapsed):
+        entry = {
+            "time": time.time(),
+            "query": trace.query,
+            "total_ms": elapsed,
+            "stages_ms": trace.stages,
+            "posting_lengths": trace.posting_lengths,
+        }
+        with self.lock, open(self.slow_query_log_path, "ab") as f:
+            f.write(orjson.dumps(entry) + b"\n")
+
+    def snapshot(self, extra_counters=None):
+        with self.lock:
+            self._fold_finished_threads()
+            counters = dict(self.counters)
+            for _, thread_counters in self.thread_counters:
+                # Copied in one step; only the owning thread writes to it
+                for name, value in dict(thread_counters).items():
+                    counters[name] = counters.get(name, 0) + value
+            histograms = {
+                name: {
+                    "count": histogram.count,
+                    "sum_ms": histogram.sum,
+                    "p50_ms": histogram.quantile(0.50),
+                    "p95_ms": histogram.quantile(0.95),
+                    "p99_ms": histogram.quantile(0.99),
+                    "buckets": dict(zip([str(bound) for bound in histogram.buckets] + ["+Inf"], histogram.counts)),
+                }
+                for name, histogram in self.histograms.items()
+            }
+        counters.update(extra_counters or {})
+        return {"pid": os.getpid(), "uptime_s": time.time() - self.started,
+                "counters": counters, "histograms": histograms}
+
+    def prometheus(self, extra_counters=None):
+        """The snapshot in the Prometheus text exposition format."""
+        snapshot = self.snapshot(extra_counters)
+        labels = f'pid="{snapshot["pid"]}"'
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            kind = "gauge" if name.endswith(GAUGE_SUFFIXES) else "counter"
+            lines.append(f"# TYPE search_{name} {kind}")
+            lines.append(f"search_{name}{{{labels}}} {value}")
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            lines.append(f"# TYPE search_{name}_ms histogram")
+            cumulative = 0
+            for bound, count in histogram["buckets"].items():
+                cumulative += count
+                lines.append(f'search_{name}_ms_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"search_{name}_ms_sum{{{labels}}} {histogram['sum_ms']}")
+            lines.append(f"search_{name}_ms_count{{{labels}}} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
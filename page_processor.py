@@ -1,10 +1,14 @@
 import os
 import sys
 import json
+import argparse
+import multiprocessing
 from bs4 import BeautifulSoup
-from text_processor import tokenize, stem_words
+from lxml import etree
+from text_processor import analyzer
 from urllib.parse import urldefrag, urljoin, urlparse, urlunparse, parse_qsl, urlencode, quote, unquote
 from simhashdb import SimhashManager
+from shards import SHARD_DIR, PROCESSED_FILES_DIR, ShardWriter, set_corpus_path
 from pathlib import Path
 import tqdm
 
@@ -14,6 +18,14 @@ import ipaddress
 
 simhash = SimhashManager()
 urls_set = set()
+shard_writer = None  # ShardWriter when run with --shards
+PARALLEL_CHUNKSIZE = 16
+
+HEADING_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+BOLD_TAGS = ('b', 'strong')
+REMOVED_TAGS = frozenset(('title',) + HEADING_TAGS + BOLD_TAGS)
+# Strings inside these tags are not page text (BeautifulSoup's string containers)
+STRING_CONTAINER_TAGS = frozenset(('rt', 'rp', 'style', 'script', 'template'))
 
 def get_file_content(filepath):
     encoding_type = ''
@@ -34,9 +46,13 @@ def get_file_content(filepath):
     return url, content
 
 
-def process_files(input_directory, output_directory):
+def process_files(input_directory, output_directory, workers=1):
     files = list(Path(input_directory).rglob('*.json'))
 
+    if workers > 1:
+        process_files_parallel(files, output_directory, workers)
+        return
+
     for filepath in tqdm.tqdm(files):
         # print(filepath)
         url, content = get_file_content(filepath)
@@ -48,29 +64,65 @@ def process_files(input_directory, output_directory):
 
         urls_set.add(url)
 
-        content_dict = {}
-        content_dict['url'] = url
+        content_dict = extract_content(url, content)
+        save_document(filepath, output_directory, content_dict)
 
-        soup = BeautifulSoup(content, "lxml")
-        text_category = categorize_text(url, soup)
-        
-        for category, texts in text_category.items():
-            if category == 'anchor': 
-                content_dict[category] = texts
+
+def process_files_parallel(files, output_directory, workers):
+    # Workers do the parsing, tokenizing and stemming; this process stays the
+    # only one that touches urls_set and the fingerprint store, and it sees
+    # the results in file order, so duplicates resolve exactly as in the
+    # serial run. Workers are forked so that they reuse the already opened
+    # SimhashManager instead of opening the RocksDB store again.
+    context = multiprocessing.get_context('fork')
+    with context.Pool(workers) as pool:
+        results = pool.imap(process_page, files, chunksize=PARALLEL_CHUNKSIZE)
+
+        for filepath, (url, fingerprint, content_dict, stems) in zip(files, tqdm.tqdm(results, total=len(files))):
+            analyzer.update(stems)
+            if simhash.exists_duplicate_fingerprint(url, fingerprint):
                 continue
-            all_tokens = []
-            for text in texts:
-                if text is None:
-                    print(f"Detected URL IS : {url}")
-                    continue
-                tokens = tokenize(text)
-                stemmed_tokens = stem_words(tokens)
-                all_tokens.extend(stemmed_tokens)
-            
-            content_dict[category] = all_tokens
-        
-        output_filename = filepath.stem + '_processed' + filepath.suffix
-        save_file(output_filename, output_directory, content_dict)
+
+            if url in urls_set:
+                continue
+
+            urls_set.add(url)
+
+            save_document(filepath, output_directory, content_dict)
+
+
+def process_page(filepath):
+    url, content = get_file_content(filepath)
+    content_dict = extract_content(url, content)
+    # Stems this worker learned, so the coordinator's stem table covers the whole corpus
+    return url, simhash.get_fingerprint(content), content_dict, analyzer.drain_new()
+
+
+def extract_content(url, content):
+    content_dict = {}
+    content_dict['url'] = url
+
+    text_category = extract_fields(url, content)
+
+    for category, texts in text_category.items():
+        if category == 'anchor': 
+            content_dict[category] = texts
+            continue
+        if None in texts:
+            print(f"Detected URL IS : {url}")
+
+        content_dict[category] = analyzer.analyze_texts([text for text in texts if text is not None])
+
+    return content_dict
+
+
+def save_document(filepath, output_directory, content_dict):
+    if shard_writer:
+        shard_writer.add(content_dict)
+        return
+
+    output_filename = filepath.stem + '_processed' + filepath.suffix
+    save_file(output_filename, output_directory, content_dict)
 
 
 def save_file(filename, output_directory, content_dict):          
@@ -175,10 +227,192 @@ def categorize_text(url, soup):
     return text_category
 
 
-if __name__ == '__main__':
-    input_directory = sys.argv[1]
-    output_directory = './data/processed_files'
+class FieldExtractor:
+    """lxml parser target that collects the categories of categorize_text in one pass.
+
+    It follows what BeautifulSoup would build from the same parser events:
+    adjacent data events form one string, strings inside string containers
+    and comments are not text, a heading's text is its stripped strings
+    joined together, and other_text gets a space where an outermost title,
+    heading or bold element was cut out.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.categories = {'title': [], 'h1': [], 'h2': [], 'h3': [], 'h4': [], 'h5': [], 'h6': [],
+                           'bold': [], 'anchor': []}
+        self.other_text = []
+        self.pending = []
+        self.open_tags = []
+        self.open_fields = []  # (texts, index, stripped strings) of unclosed headings and bold tags
+        self.containers = 0
+        self.removed = 0
+        self.title = None  # children of the first title element, nested lists for child elements
+        self.title_path = []
+        self.links = {}
+
+    def start(self, tag, attrib):
+        self._end_data()
+        field = None
+        if tag in REMOVED_TAGS:
+            if not self.removed:
+                self.other_text.append(' ')
+            self.removed += 1
+
+            if tag != 'title':
+                texts = self.categories['bold' if tag in BOLD_TAGS else tag]
+                field = (texts, len(texts), [])
+                texts.append(None)
+                self.open_fields.append(field)
+
+        if self.title_path:
+            child = []
+            self.title_path[-1].append(child)
+            self.title_path.append(child)
+        elif tag == 'title' and self.title is None:
+            self.title = []
+            self.title_path.append(self.title)
+
+        if tag in STRING_CONTAINER_TAGS:
+            self.containers += 1
+        if tag == 'a' and 'href' in attrib:
+            self._add_link(attrib['href'])
+        self.open_tags.append((tag, field))
+
+    def end(self, tag):
+        self._end_data()
+        tag, field = self.open_tags.pop()
+        if field is not None:
+            texts, index, strings = self.open_fields.pop()
+            texts[index] = ''.join(strings)
+        if tag in REMOVED_TAGS:
+            self.removed -= 1
+        if tag in STRING_CONTAINER_TAGS:
+            self.containers -= 1
+        if self.title_path:
+            self.title_path.pop()
+
+    def data(self, data):
+        self.pending.append(data)
+
+    def comment(self, text):
+        self._end_data()
+        if self.title_path:
+            self.title_path[-1].append(text)
+
+    def doctype(self, *args):
+        self._end_data()
+
+    def pi(self, target, data=None):
+        self._end_data()
+
+    def close(self):
+        self._end_data()
+        while self.open_tags:
+            self.end(None)
+        self.categories['title'] = [_single_string(self.title)] if self.title is not None else []
+        self.categories['other_text'] = [' '.join(''.join(self.other_text).split())]
+        return self.categories
+
+    def _end_data(self):
+        if not self.pending:
+            return
+        text = ''.join(self.pending)
+        self.pending = []
+
+        if self.title_path:
+            self.title_path[-1].append(text)
+        if self.containers:
+            return
+        if not self.removed:
+            self.other_text.append(text)
+        elif self.open_fields:
+            stripped = text.strip()
+            if stripped:
+                for _, _, strings in self.open_fields:
+                    strings.append(stripped)
+
+    def _add_link(self, href):
+        # Pages repeat the same links in menus and footers; resolve each href once
+        if href in self.links:
+            normalized_url = self.links[href]
+        else:
+            normalized_url = None
+            try:
+                normalized_url = normalize_url(urljoin(self.url, href))
+            except Exception as e:
+                print(f"Skipping invalid URL '{self.url} + {href}': {e}")
+            self.links[href] = normalized_url
+
+        if normalized_url:
+            self.categories['anchor'].append(normalized_url)
+
+
+def _single_string(children):
+    """A tag's only string, like BeautifulSoup's Tag.string: None unless there is exactly one child."""
+    if len(children) != 1:
+        return None
+    child = children[0]
+    return child if isinstance(child, str) else _single_string(child)
+
 
-    os.makedirs(output_directory, exist_ok=True)
+def extract_fields(url, content):
+    """The categories of categorize_text, read in a single lxml parse without building a tree."""
+    if content[:1] == '\N{BYTE ORDER MARK}':
+        content = content[1:]
 
-    process_files(input_directory, output_directory)
\ No newline at end of file
+    # Like BeautifulSoup, fall back to UTF-8 bytes when lxml rejects the str
+    for markup, encoding in ((content, None), (content.encode('utf8'), 'utf8')):
+        parser = etree.HTMLParser(target=FieldExtractor(url), recover=True, encoding=encoding)
+        try:
+            parser.feed(markup)
+            return parser.close()
+        except (UnicodeDecodeError, LookupError, etree.ParserError):
+            continue
+    return categorize_text(url, BeautifulSoup(content, "lxml"))
+
+
+def compare_extraction(input_directory):
+    """Report pages where extract_fields and categorize_text disagree."""
+    files = sorted(Path(input_directory).rglob('*.json'))
+    mismatches = 0
+    for filepath in tqdm.tqdm(files):
+        url, content = get_file_content(filepath)
+        expected = categorize_text(url, BeautifulSoup(content, "lxml"))
+        actual = extract_fields(url, content)
+        categories = [category for category in expected if expected[category] != actual.get(category)]
+        if categories:
+            mismatches += 1
+            print(f"{filepath}: {', '.join(categories)} differ")
+
+    print(f"{mismatches} of {len(files)} pages differ")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input_directory')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--compare-extraction', action='store_true',
+                        help='only check the single-pass extractor against BeautifulSoup on the input pages')
+    parser.add_argument('--shards', action='store_true',
+                        help=f'append the documents to shard files in {SHARD_DIR} instead of one JSON file each')
+    parser.add_argument('--term-ids', action='store_true', help='with --shards, store token streams as term ids')
+    args = parser.parse_args()
+
+    if args.compare_extraction:
+        compare_extraction(args.input_directory)
+        sys.exit()
+
+    output_directory = PROCESSED_FILES_DIR
+
+    if args.shards:
+        shard_writer = ShardWriter(term_ids=args.term_ids)
+    else:
+        os.makedirs(output_directory, exist_ok=True)
+
+    process_files(args.input_directory, output_directory, workers=args.workers)
+    if shard_writer:
+        shard_writer.close()
+    # indexer.py and pagerank.py read whichever corpus this run wrote
+    set_corpus_path(SHARD_DIR if shard_writer else output_directory)
+    analyzer.save()
\ No newline at end of file
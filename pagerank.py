@@ -1,9 +1,13 @@
 import os
+import sys
+import argparse
 from urllib.parse import urlparse, urlunparse, quote
 import warnings
+from array import array
 
-import networkx as nx
+import numpy as np
 import orjson as oj
+from scipy import sparse
 from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning, MarkupResemblesLocatorWarning, GuessedAtParserWarning
 from tqdm import tqdm
 from pathlib import Path
@@ -11,6 +15,12 @@ import json
 from collections import defaultdict
 import orjson
 from decimal import Decimal
+from doctable import DOC_TABLE_PATH, build_doc_table, update_page_ranks
+from segments import MANIFEST_PATH, update_segment_page_ranks
+from shards import corpus_path, is_shard_path, read_anchors
+
+LINK_GRAPH_PATH = 'data/link_graph.npz'
+LINK_GRAPH_URLS_PATH = 'data/link_graph.json'
 
 def getPageRanks():
     with open('data/url_mapping_with_pagerank.json', 'r') as infile:
@@ -31,59 +41,227 @@ def standardize_url(url: str) -> str:
         quote(p.fragment, safe="#")
     ))
 
-def pagerank(i: list[dict[str, str]]):
-    allnodes = set()
-    G = nx.DiGraph()
-    print("Phase 1: Read URLs")
-    for e in tqdm(range(len(i))):
-        nurl = (i[e]["url"])
-        if nurl is None:
-            raise ValueError("Error: input URL is invalid, this cannot happen")
-        G.add_node(nurl)
-        allnodes.add(nurl)
-        i[e]["nurl"] = nurl
-    print("Phase 2: Read connections")
-    for v in tqdm(range(len(i))):
-        e = i[v]
-        url = e["url"]
-        anchors = e["anchor"]
+def iter_links(paths):
+    """Yield (url, http anchors) of every processed file or shard under the given files or directories."""
+    for path in paths:
+        if is_shard_path(path):
+            for url, anchors in read_anchors(path):
+                yield url, [a for a in anchors if a.startswith("http")]
+            continue
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = [os.path.join(r, f) for r, _, fs in os.walk(path) for f in fs]
+
+        for file_path in tqdm(files):
+            with open(file_path, "rb") as fp:
+                data = oj.loads(fp.read())
+
+            url = data["url"]
+            if url is None:
+                raise ValueError("Error: input URL is invalid, this cannot happen")
+            yield url, [a for a in data.get("anchor", []) if a.startswith("http")]
+
+def read_link_graph(folder_path):
+    """Stream the processed files into a CSR adjacency matrix over integer node ids.
+
+    Only the url and anchor fields of each document are kept. Node ids follow
+    the order documents are read; repeated links between the same pair count
+    once, as they did in the networkx graph. Links to URLs that are not
+    documents are left out of the matrix and returned as pending links
+    (target url -> source nodes) for incremental updates.
+    """
+    ids = {}  # every URL seen, document or link target -> provisional id
+    doc_ids = array("q")
+    sources = array("q")
+    targets = array("q")
+
+    print("Phase 1: Read URLs and connections")
+    for url, anchors in iter_links([folder_path]):
+        source = ids.setdefault(url, len(ids))
+        doc_ids.append(source)
+
+        for a in anchors:
+            sources.append(source)
+            targets.append(ids.setdefault(a, len(ids)))
+
+    # Renumber documents 0..N-1 in first-seen order
+    unique_ids, first_seen = np.unique(np.frombuffer(doc_ids, dtype=np.int64), return_index=True)
+    doc_nodes = unique_ids[np.argsort(first_seen)]
+    node_of = np.full(len(ids), -1, dtype=np.int64)
+    node_of[doc_nodes] = np.arange(len(doc_nodes))
+
+    print("Phase 2: Build adjacency matrix")
+    rows = node_of[np.frombuffer(sources, dtype=np.int64)]
+    provisional_targets = np.frombuffer(targets, dtype=np.int64)
+    cols = node_of[provisional_targets]
+    keep = cols >= 0
+
+    url_of = {provisional: url for url, provisional in ids.items()}
+    node_urls = [url_of[provisional] for provisional in doc_nodes.tolist()]
+    pending = defaultdict(list)
+    for source, target in zip(rows[~keep].tolist(), provisional_targets[~keep].tolist()):
+        pending[url_of[target]].append(source)
+    del ids, url_of
+
+    return node_urls, _build_adjacency(rows[keep], cols[keep], len(node_urls)), dict(pending)
+
+def _build_adjacency(rows, cols, n):
+    adjacency = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    adjacency.sum_duplicates()
+    adjacency.data[:] = 1.0
+    return adjacency
+
+def pagerank_sparse(adjacency, alpha=0.85, max_iter=100, tol=1.0e-6, start=None):
+    """Power iteration over a CSR adjacency matrix, with the networkx semantics.
+
+    Rows are normalized by out-degree; the rank of dangling nodes (no out-links)
+    and the teleport share are spread uniformly. Stops when the L1 change is
+    below n * tol. start warm-starts the iteration from a previous score
+    vector instead of the uniform one. Returns the score vector and the
+    number of iterations.
+    """
+    n = adjacency.shape[0]
+    if n == 0:
+        return np.zeros(0), 0
+
+    out_degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    inverse_degree = np.divide(1.0, out_degree, out=np.zeros(n), where=out_degree != 0)
+    # x @ (D^-1 A) computed as (D^-1 A)^T @ x, with the transpose stored as CSR
+    transition = (sparse.diags(inverse_degree) @ adjacency).T.tocsr()
+    dangling = out_degree == 0
+
+    uniform = np.full(n, 1.0 / n)
+    x = uniform.copy() if start is None else start / start.sum()
+    for iteration in range(1, max_iter + 1):
+        xlast = x
+        x = alpha * (transition @ x + x[dangling].sum() * uniform) + (1 - alpha) * uniform
+        if np.abs(x - xlast).sum() < n * tol:
+            return x, iteration
+
+    raise RuntimeError(f"PageRank did not converge in {max_iter} iterations")
+
+def save_link_graph(node_urls, adjacency, scores, pending):
+    np.savez(LINK_GRAPH_PATH, indptr=adjacency.indptr, indices=adjacency.indices, scores=scores)
+    Path(LINK_GRAPH_URLS_PATH).write_bytes(orjson.dumps({"urls": node_urls, "pending": pending}))
+
+def load_link_graph():
+    arrays = np.load(LINK_GRAPH_PATH)
+    state = orjson.loads(Path(LINK_GRAPH_URLS_PATH).read_bytes())
+    n = len(state["urls"])
+    indices = arrays["indices"]
+    adjacency = sparse.csr_matrix((np.ones(len(indices)), indices, arrays["indptr"]), shape=(n, n))
+    return state["urls"], adjacency, arrays["scores"], state["pending"]
+
+def normalize_scores(node_urls, scores):
+    """Min-max normalize raw scores into a url -> score dict."""
+    min_score = scores.min()
+    max_score = scores.max()
+    score_range = max_score - min_score if max_score != min_score else 1  # Avoid division by zero
+    return dict(zip(node_urls, ((scores - min_score) / score_range).tolist()))
+
+def write_page_rank_mapping(url_mapping, normalized):
+    """Save url -> (doc_id, normalized PageRank) of every indexed document, highest first."""
+    mapping = {url: (doc_id, normalized.get(url, 0)) for url, doc_id in url_mapping.items()}
+    sorted_data = dict(sorted(mapping.items(), key=lambda item: float(item[1][1]), reverse=True))
+    Path('data/url_mapping_with_pagerank.json').write_bytes(orjson.dumps(sorted_data, option=orjson.OPT_INDENT_2))
+    return sorted_data
+
+def update_incrementally(paths, verify=False):
+    """Apply new or re-crawled processed files to the stored graph and warm-start PageRank.
+
+    Each file replaces the out-links of its URL (adding the node if it is new).
+    Pending links from earlier documents to a URL that has now become a
+    document are turned into edges. The iteration starts from the previous
+    scores, with new nodes at 1/n. Only the PageRank column of the doc table
+    (and of the segment doc tables) is rewritten, in place; the stored graph
+    keeps the raw scores. url_mapping_with_pagerank.json stays as the last full
+    run wrote it: an index rebuild resets the column and is followed by a full
+    run anyway.
+    """
+    node_urls, adjacency, old_scores, pending = load_link_graph()
+    node_of = {url: node for node, url in enumerate(node_urls)}
+
+    changed = {}
+    for url, anchors in iter_links(paths):
+        if url not in node_of:
+            node_of[url] = len(node_urls)
+            node_urls.append(url)
+        changed[node_of[url]] = anchors
+
+    # Out-links of changed documents are replaced, including their pending ones
+    changed_nodes = np.fromiter(changed, dtype=np.int64)
+    pending = {url: [source for source in sources if source not in changed]
+               for url, sources in pending.items()}
+
+    new_rows, new_cols = [], []
+    for node in range(len(old_scores), len(node_urls)):
+        sources = pending.pop(node_urls[node], [])
+        new_rows.extend(sources)
+        new_cols.extend([node] * len(sources))
+    for source, anchors in changed.items():
         for a in anchors:
-            if not a.startswith("http"):
-                continue
-            nurl = (a)
-            if nurl is None:
-                continue
-            if not nurl in allnodes:
-                continue
-            G.add_edge(url, nurl)
-    print("Phase 3: Run PageRank")
-    R = nx.pagerank(G, 0.85)
-    return R
-    
+            if a in node_of:
+                new_rows.append(source)
+                new_cols.append(node_of[a])
+            else:
+                pending.setdefault(a, []).append(source)
+    pending = {url: sources for url, sources in pending.items() if sources}
+
+    old_edges = adjacency.tocoo()
+    keep = ~np.isin(old_edges.row, changed_nodes)
+    rows = np.concatenate([old_edges.row[keep], np.array(new_rows, dtype=np.int64)])
+    cols = np.concatenate([old_edges.col[keep], np.array(new_cols, dtype=np.int64)])
+    n = len(node_urls)
+    adjacency = _build_adjacency(rows, cols, n)
+
+    added = n - len(old_scores)
+    print(f"Updated {len(changed)} documents ({added} new), graph has {n} nodes and {adjacency.nnz} edges")
+    start = np.concatenate([old_scores, np.full(added, 1.0 / n)])
+    scores, iterations = pagerank_sparse(adjacency, start=start)
+    print(f"Warm start converged after {iterations} iterations")
+
+    if verify:
+        full_scores, full_iterations = pagerank_sparse(adjacency)
+        top = min(100, n)
+        overlap = len(set(np.argsort(-scores)[:top]) & set(np.argsort(-full_scores)[:top]))
+        print(f"Full recompute converged after {full_iterations} iterations")
+        print(f"L1 distance to full recompute: {np.abs(scores - full_scores).sum():.3e}, "
+              f"max difference: {np.abs(scores - full_scores).max():.3e}, top-{top} overlap: {overlap}/{top}")
+
+    save_link_graph(node_urls, adjacency, scores, pending)
+
+    normalized = normalize_scores(node_urls, scores)
+    url_mapping = orjson.loads(Path('data/url_mapping.json').read_bytes())
+    update_page_ranks({doc_id: normalized.get(url, 0) for url, doc_id in url_mapping.items()})
+    if os.path.exists(MANIFEST_PATH):
+        update_segment_page_ranks(normalized)
+
 if __name__ == "__main__":
     warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
     warnings.filterwarnings("ignore", category=GuessedAtParserWarning)
     warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
-    docs = []
-    for r, _, fs in os.walk("data/processed_files"):
-        for f in fs:
-            with open(os.path.join(r, f), "r", encoding="utf-8") as fp:
-                docs.append(oj.loads(fp.read()))
-    
-    Rdict = pagerank(docs)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incremental', nargs='+', metavar='PATH',
+                        help='processed files, shards or directories of new/re-crawled pages to apply to the stored graph')
+    parser.add_argument('--verify', action='store_true',
+                        help='with --incremental, also run a full recompute and report the difference')
+    args = parser.parse_args()
+
+    if args.incremental:
+        update_incrementally(args.incremental, verify=args.verify)
+        sys.exit()
+
+    node_urls, adjacency, pending = read_link_graph(corpus_path())
+    print(f"Phase 3: Run PageRank on {adjacency.shape[0]} nodes and {adjacency.nnz} edges")
+    scores, iterations = pagerank_sparse(adjacency)
+    print(f"Converged after {iterations} iterations")
+    save_link_graph(node_urls, adjacency, scores, pending)
 
     # Apply min-max normalization
     print("Applying min-max normalization...")
-    scores = list(Rdict.values())
-    min_score = min(scores)
-    max_score = max(scores)
-    score_range = max_score - min_score if max_score != min_score else 1  # Avoid division by zero
-    
-    # Normalize the scores
-    normalized_Rdict = {}
-    for url, score in Rdict.items():
-        normalized_score = (score - min_score) / score_range
-        normalized_Rdict[url] = normalized_score
+    normalized_Rdict = normalize_scores(node_urls, scores)
 
     # Add normalized page rank values to url_mapping_with_pagerank.json
     with open('data/url_mapping.json', 'r') as infile:
@@ -99,10 +277,13 @@ if __name__ == "__main__":
                 dataWithPageRank[doc_url] = (doc_id, 0)
                 print(doc_url)
 
-        sorted_data = dict(sorted(dataWithPageRank.items(), key=lambda item: float(item[1][1]), reverse=True))
-        print(f"threshold is: {list(sorted_data.items())[-15000][1]}")
-        
-        Path('data/url_mapping_with_pagerank.json').write_bytes(orjson.dumps(sorted_data, option=orjson.OPT_INDENT_2))
+        sorted_data = write_page_rank_mapping(data, normalized_Rdict)
+        print(f"threshold is: {list(sorted_data.items())[-min(15000, len(sorted_data))][1]}")
+
+        if os.path.exists(DOC_TABLE_PATH):
+            update_page_ranks({doc_id: page_rank for doc_id, page_rank in dataWithPageRank.values()})
+        else:
+            build_doc_table()
         print(f"not found urls: {notFoundUrls}")
         print(f"Min normalized score: {min(normalized_Rdict.values())}")
         print(f"Max normalized score: {max(normalized_Rdict.values())}")
\ No newline at end of file
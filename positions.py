@@ -0,0 +1,194 @@
+import os
+import io
+import heapq
+import struct
+from array import array
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+
+import numpy as np
+import orjson
+from tqdm import tqdm
+
+from index_builder import _read_run, _TERM_LEN, _BLOB_LEN
+
+# Positional posting list layout (all integers little-endian):
+#
+#   header     <BBI  version, gap width, document count
+#   doc ids    count * 4 bytes          ascending, absolute so a document is found by binary search
+#   offsets    (count + 1) * 4 bytes    index of each document's first position in the gaps
+#   gaps       offsets[count] * width   position deltas, restarting at 0 for every document
+#
+# Only the documents a query needs are decoded: their slice of the gaps is
+# located through the offsets without touching the other documents.
+FORMAT_VERSION = 1
+POSITIONS_FILENAME = "positions"
+
+# Sections are laid out one after another in this order; a run of unused
+# positions between them keeps phrases from matching across sections.
+SECTION_GAP = 64
+MAX_SLOP = SECTION_GAP // 2
+
+_HEADER = struct.Struct("<BBI")
+_DTYPES = {1: "<u1", 2: "<u2", 4: "<u4"}
+
+POSTING_BYTES = 2 * array("I").itemsize
+POSITION_BYTES = array("I").itemsize
+TERM_OVERHEAD = 250
+
+
+def document_positions(sections):
+    """term -> ascending positions of a document's tokens over all sections."""
+    positions = defaultdict(list)
+    position = 0
+    for terms in sections.values():
+        for term in terms:
+            positions[term].append(position)
+            position += 1
+        position += SECTION_GAP
+    return positions
+
+
+def encode_positions(documents):
+    """Encode (doc_id, positions) pairs sorted by doc id; positions ascending per document."""
+    doc_ids = []
+    offsets = [0]
+    gaps = []
+    for doc_id, positions in documents:
+        doc_ids.append(doc_id)
+        previous = 0
+        for position in positions:
+            gaps.append(position - previous)
+            previous = position
+        offsets.append(len(gaps))
+
+    max_gap = max(gaps, default=0)
+    width = 1 if max_gap < 1 << 8 else 2 if max_gap < 1 << 16 else 4
+    return (_HEADER.pack(FORMAT_VERSION, width, len(doc_ids))
+            + np.asarray(doc_ids, dtype="<u4").tobytes()
+            + np.asarray(offsets, dtype="<u4").tobytes()
+            + np.asarray(gaps, dtype=_DTYPES[width]).tobytes())
+
+
+def _layout(data):
+    version, width, count = _HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported positions format version {version}")
+    doc_ids = np.frombuffer(data, dtype="<u4", count=count, offset=_HEADER.size)
+    offsets = np.frombuffer(data, dtype="<u4", count=count + 1, offset=_HEADER.size + count * 4)
+    gaps = np.frombuffer(data, dtype=_DTYPES[width], offset=_HEADER.size + (2 * count + 1) * 4)
+    return doc_ids, offsets, gaps
+
+
+def position_doc_ids(data):
+    return _layout(data)[0]
+
+
+def decode_positions(data, doc_ids):
+    """Positions of the given documents (which must appear in the list), decoding nothing else."""
+    all_doc_ids, offsets, gaps = _layout(data)
+    indexes = np.searchsorted(all_doc_ids, doc_ids)
+    return [np.cumsum(gaps[offsets[i]:offsets[i + 1]], dtype=np.int64) for i in indexes]
+
+
+def decode_all(data):
+    doc_ids, offsets, gaps = _layout(data)
+    return [(int(doc_id), np.cumsum(gaps[offsets[i]:offsets[i + 1]], dtype=np.int64).tolist())
+            for i, doc_id in enumerate(doc_ids)]
+
+
+def phrase_matches(position_lists, slop=0):
+    """Whether the terms occur in order with at most slop extra positions in between."""
+    starts = position_lists[0]
+    if slop == 0:
+        for offset, positions in enumerate(position_lists[1:], 1):
+            starts = starts[np.isin(starts + offset, positions)]
+        return len(starts) > 0
+
+    # For every start, the earliest following occurrence of each next term
+    # gives the tightest window beginning there
+    ends = starts
+    for positions in position_lists[1:]:
+        following = np.searchsorted(positions, ends, side="right")
+        found = following < len(positions)
+        starts, ends = starts[found], positions[following[found]]
+    return bool(np.any(ends - starts - (len(position_lists) - 1) <= slop))
+
+
+class PositionBuilder:
+    """Builds data/<filename>.dat/.idx positional postings with sorted runs and a k-way merge, like IndexBuilder."""
+
+    def __init__(self, filename=POSITIONS_FILENAME, memory_limit=100 * 1024 * 1024, run_dir=None):
+        self.data_file_path = "data/" + filename + ".dat"
+        self.index_file_path = "data/" + filename + ".idx"
+        self.run_dir = run_dir or os.path.join("data/runs", filename)
+        self.memory_limit = memory_limit
+
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.run_paths = []
+        self.buffer = {}
+        self.memory_size = 0
+
+    def add_document(self, doc_id, sections):
+        for term, positions in document_positions(sections).items():
+            self._append(term, doc_id, positions)
+
+        if self.memory_size >= self.memory_limit:
+            self._write_run()
+
+    def add_postings(self, term, documents):
+        """Add already decoded (doc_id, positions) pairs of a term; doc ids must follow those added before."""
+        for doc_id, positions in documents:
+            self._append(term, doc_id, positions)
+
+        if self.memory_size >= self.memory_limit:
+            self._write_run()
+
+    def _append(self, term, doc_id, positions):
+        entry = self.buffer.get(term)
+        if entry is None:
+            entry = self.buffer[term] = []
+            self.memory_size += TERM_OVERHEAD + len(term)
+        entry.append((doc_id, array("I", positions)))
+        self.memory_size += POSTING_BYTES + POSITION_BYTES * len(positions)
+
+    def _write_run(self):
+        if not self.buffer:
+            return
+
+        run_path = os.path.join(self.run_dir, f"run_{len(self.run_paths):05d}.bin")
+        with open(run_path, "wb", buffering=io.DEFAULT_BUFFER_SIZE * 16) as f:
+            for term in tqdm(sorted(self.buffer), desc=f"Writing {run_path}"):
+                term_bytes = term.encode()
+                blob = encode_positions(self.buffer[term])
+                f.write(_TERM_LEN.pack(len(term_bytes)) + term_bytes + _BLOB_LEN.pack(len(blob)) + blob)
+
+        self.run_paths.append(run_path)
+        self.buffer = {}
+        self.memory_size = 0
+
+    def close(self):
+        self._write_run()
+        disk_index = {}
+
+        runs = [_read_run(path, run_no) for run_no, path in enumerate(self.run_paths)]
+        # Swapped in whole, like IndexBuilder's posting file
+        tmp_path = self.data_file_path + ".tmp"
+        with open(tmp_path, "wb", buffering=io.DEFAULT_BUFFER_SIZE * 16) as data_file:
+            for term, records in tqdm(groupby(heapq.merge(*runs), key=itemgetter(0)), desc="Merging position runs"):
+                documents = []
+                for _, _, blob in records:
+                    documents.extend(decode_all(blob))
+
+                value_bytes = encode_positions(documents)
+                disk_index[term] = (data_file.tell(), len(value_bytes))
+                data_file.write(value_bytes)
+
+        os.replace(tmp_path, self.data_file_path)
+        Path(self.index_file_path).write_bytes(orjson.dumps(disk_index))
+
+        for path in self.run_paths:
+            os.remove(path)
+        self.run_paths = []
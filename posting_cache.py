@@ -0,0 +1,185 @@
+import os
+import threading
+from collections import Counter, OrderedDict
+
+import orjson
+
+POSTING_CACHE_BYTES = 256 * 1024 * 1024
+QUERY_LOG_PATH = 'data/query_log.jsonl'
+WARM_LOG_BYTES = 8 * 1024 * 1024  # only the most recent part of the query log is replayed at startup
+
+SKETCH_WIDTH = 1 << 16  # counters per row
+SKETCH_DEPTH = 4
+MAX_FREQUENCY = 15  # counters saturate here, like TinyLFU's 4-bit counters
+HALVE = bytes(value >> 1 for value in range(256))
+
+
+class FrequencySketch:
+    """Count-min sketch of how often each term was looked up recently.
+
+    After sample_size additions every counter is halved, so the estimates
+    follow the current query mix rather than all history.
+    """
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH, sample_size=None):
+        self.mask = width - 1
+        self.rows = [bytearray(width) for _ in range(depth)]
+        self.sample_size = sample_size or 10 * width
+        self.additions = 0
+
+    def _indexes(self, term):
+        return [hash((row, term)) & self.mask for row in range(len(self.rows))]
+
+    def increment(self, term, count=1):
+        for row, index in zip(self.rows, self._indexes(term)):
+            row[index] = min(row[index] + count, MAX_FREQUENCY)
+
+        self.additions += count
+        if self.additions >= self.sample_size:
+            self.rows = [bytearray(row.translate(HALVE)) for row in self.rows]
+            self.additions //= 2
+
+    def estimate(self, term):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(term)))
+
+
+class PostingCache:
+    """Decoded posting lists shared by every DiskDict of the process, bounded by bytes.
+
+    Entries are kept in LRU order. Every lookup counts towards its term's
+    frequency; once the cache is full a new list is only admitted if its
+    term was looked up more often than each of the least recently used
+    entries it would evict (TinyLFU admission), so one-off terms with huge
+    lists do not flush the frequent ones.
+    """
+
+    def __init__(self, max_bytes=POSTING_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # (owner, kind, term) -> (value, size)
+        self.sketch = FrequencySketch()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.query_log_path = None  # set to log every query's terms for the next warm start
+
+    def get(self, key):
+        with self.lock:
+            self.sketch.increment(key[2])
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Cache value unless the admission policy rejects it; returns whether it was admitted."""
+        with self.lock:
+            if key in self.entries or size > self.max_bytes:
+                return False
+
+            victims = []
+            freed = 0
+            if self.resident_bytes + size > self.max_bytes:
+                frequency = self.sketch.estimate(key[2])
+                for victim, (_, victim_size) in self.entries.items():
+                    if self.sketch.estimate(victim[2]) >= frequency:
+                        self.rejected += 1
+                        return False
+                    victims.append(victim)
+                    freed += victim_size
+                    if self.resident_bytes - freed + size <= self.max_bytes:
+                        break
+
+            for victim in victims:
+                del self.entries[victim]
+            self.resident_bytes += size - freed
+            self.evictions += len(victims)
+            self.entries[key] = (value, size)
+            self.admitted += 1
+            return True
+
+    def resize(self, max_bytes):
+        """Change the budget, evicting the least frequently looked up terms first (least recent on ties)."""
+        with self.lock:
+            self.max_bytes = max_bytes
+            if self.resident_bytes <= max_bytes:
+                return
+
+            ranked = sorted(enumerate(self.entries), key=lambda item: (self.sketch.estimate(item[1][2]), item[0]))
+            for _, key in ranked:
+                if self.resident_bytes <= max_bytes:
+                    break
+                self.resident_bytes -= self.entries.pop(key)[1]
+                self.evictions += 1
+
+    def discard(self, owner):
+        """Drop the entries of a DiskDict that is being closed."""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == owner]:
+                self.resident_bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        """Drop every entry, keeping the term frequencies."""
+        with self.lock:
+            self.entries.clear()
+            self.resident_bytes = 0
+
+    def full(self):
+        return self.resident_bytes >= self.max_bytes
+
+    def log_query(self, terms):
+        if self.query_log_path is None or not terms:
+            return
+        with self.lock, open(self.query_log_path, "ab") as f:
+            f.write(orjson.dumps(terms) + b"\n")
+
+    def warm_terms(self, path=QUERY_LOG_PATH):
+        """Terms of the most recent logged queries, most frequent first, with the sketch seeded by their counts."""
+        if not os.path.exists(path):
+            return []
+
+        with open(path, "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - WARM_LOG_BYTES))
+            lines = f.read().split(b"\n")
+        if size > WARM_LOG_BYTES:
+            lines = lines[1:]  # the first line is probably cut off
+
+        counts = Counter()
+        for line in lines:
+            if line:
+                counts.update(orjson.loads(line))
+
+        with self.lock:
+            for term, count in counts.items():
+                self.sketch.increment(term, min(count, MAX_FREQUENCY))
+        return [term for term, _ in counts.most_common()]
+
+    def reset_counters(self):
+        with self.lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries),
+                'resident_bytes': self.resident_bytes,
+                'max_bytes': self.max_bytes,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'evictions': self.evictions,
+            }
+
+
+posting_cache = PostingCache()
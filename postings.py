@@ -0,0 +1,189 @@
+import os
+import sys
+import io
+import struct
+from array import array
+from itertools import accumulate, repeat
+from operator import truediv
+from pathlib import Path
+
+import numpy as np
+import orjson
+
+# Binary posting list layout (all integers little-endian):
+#
+#   header   <BBBBI  version, gap width, score kind, score width, count
+#   gaps     count * gap width bytes    doc id deltas (first one is relative to 0)
+#   scores   count * score width bytes  fixed-point impacts or float64 values
+#
+# Doc ids must be ascending. Widths are chosen per list so that short or
+# dense lists pack into 1 or 2 bytes per value.
+FORMAT_VERSION = 1
+SCALE = 10000  # fixed-point scale, same precision as the old "%.4f" strings
+
+SCORE_FIXED = 0
+SCORE_FLOAT = 1
+
+_HEADER = struct.Struct("<BBBBI")
+HEADER_SIZE = _HEADER.size
+
+_TYPECODES = {1: "B", 2: "H", 4: "I" if array("I").itemsize == 4 else "L", 8: "Q"}
+_FLOAT_TYPECODE = "d"
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+def _width_for(max_value):
+    if max_value < 1 << 8:
+        return 1
+    if max_value < 1 << 16:
+        return 2
+    if max_value < 1 << 32:
+        return 4
+    return 8
+
+
+def _pack(values, typecode):
+    arr = array(typecode, values)
+    if _BIG_ENDIAN:
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _unpack(data, typecode):
+    arr = array(typecode)
+    arr.frombytes(data)
+    if _BIG_ENDIAN:
+        arr.byteswap()
+    return arr
+
+
+def quantize(score):
+    return round(score * SCALE)
+
+
+def encode_postings(postings, quantized=True):
+    """Encode an iterable of (doc_id, score) pairs sorted by doc id."""
+    gaps = []
+    scores = []
+    previous = 0
+    for doc_id, score in postings:
+        gap = doc_id - previous
+        if gap < 0:
+            raise ValueError(f"Postings are not sorted by doc id: {doc_id} after {previous}")
+        gaps.append(gap)
+        scores.append(quantize(float(score)) if quantized else float(score))
+        previous = doc_id
+
+    gap_width = _width_for(max(gaps, default=0))
+    if quantized:
+        if scores and min(scores) < 0:
+            raise ValueError("Fixed-point scores must not be negative")
+        score_kind, score_width = SCORE_FIXED, _width_for(max(scores, default=0))
+        score_bytes = _pack(scores, _TYPECODES[score_width])
+    else:
+        score_kind, score_width = SCORE_FLOAT, 8
+        score_bytes = _pack(scores, _FLOAT_TYPECODE)
+
+    header = _HEADER.pack(FORMAT_VERSION, gap_width, score_kind, score_width, len(gaps))
+    return header + _pack(gaps, _TYPECODES[gap_width]) + score_bytes
+
+
+def read_header(data):
+    version, gap_width, score_kind, score_width, count = _HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported posting format version {version}")
+    return gap_width, score_kind, score_width, count
+
+
+def posting_count(data):
+    """Number of postings in an encoded list, without decoding it."""
+    if is_legacy(data):
+        return len(orjson.loads(data))
+    return read_header(data)[3]
+
+
+def decode_columns(data):
+    """Decode an encoded list into parallel (doc_ids, scores) lists."""
+    if is_legacy(data):
+        pairs = orjson.loads(data)
+        return [doc_id for doc_id, _ in pairs], [float(score) for _, score in pairs]
+
+    gap_width, score_kind, score_width, count = read_header(data)
+    gaps_end = HEADER_SIZE + count * gap_width
+    gaps = _unpack(data[HEADER_SIZE:gaps_end], _TYPECODES[gap_width])
+    doc_ids = list(accumulate(gaps))
+
+    raw_scores = data[gaps_end:gaps_end + count * score_width]
+    if score_kind == SCORE_FIXED:
+        # Division (not multiplication by 1/SCALE) so that decoded values equal
+        # float("0.1234") exactly, like the old string format did.
+        scores = list(map(truediv, _unpack(raw_scores, _TYPECODES[score_width]), repeat(SCALE)))
+    else:
+        scores = _unpack(raw_scores, _FLOAT_TYPECODE).tolist()
+
+    return doc_ids, scores
+
+
+def decode_arrays(data):
+    """Decode an encoded list straight into NumPy (doc_ids, scores) arrays."""
+    if is_legacy(data):
+        doc_ids, scores = decode_columns(data)
+        return np.array(doc_ids, dtype=np.int64), np.array(scores, dtype=np.float64)
+
+    gap_width, score_kind, score_width, count = read_header(data)
+    gaps_end = HEADER_SIZE + count * gap_width
+    gaps = np.frombuffer(data, dtype=f"<u{gap_width}", count=count, offset=HEADER_SIZE)
+    doc_ids = np.cumsum(gaps, dtype=np.int64)
+
+    if score_kind == SCORE_FIXED:
+        scores = np.frombuffer(data, dtype=f"<u{score_width}", count=count, offset=gaps_end) / SCALE
+    else:
+        scores = np.frombuffer(data, dtype="<f8", count=count, offset=gaps_end).copy()
+
+    return doc_ids, scores
+
+
+def decode_postings(data):
+    """Decode an encoded list into a list of (doc_id, score) tuples."""
+    doc_ids, scores = decode_columns(data)
+    return list(zip(doc_ids, scores))
+
+
+def is_legacy(data):
+    """True for the old orjson text lines written before the binary format."""
+    return data[:1] == b"["
+
+
+def convert_diskdict(filename="diskdict"):
+    """Rewrite an old orjson .dat/.idx pair into the binary posting format.
+
+    Only the live entry of each key is copied, so the dead copies left behind
+    by earlier flushes are dropped as well.
+    """
+    data_file_path = "data/" + filename + ".dat"
+    index_file_path = "data/" + filename + ".idx"
+    new_data_file_path = data_file_path + ".tmp"
+
+    disk_index = orjson.loads(Path(index_file_path).read_bytes())
+    new_index = {}
+    converted = 0
+
+    with open(data_file_path, "rb") as old_f, \
+         open(new_data_file_path, "wb", buffering=io.DEFAULT_BUFFER_SIZE) as new_f:
+        for key, (offset, length) in disk_index.items():
+            old_f.seek(offset)
+            value = old_f.read(length)
+            if is_legacy(value):
+                value = encode_postings((doc_id, float(score)) for doc_id, score in orjson.loads(value))
+                converted += 1
+            new_offset = new_f.tell()
+            new_f.write(value)
+            new_index[key] = (new_offset, len(value))
+
+    os.replace(new_data_file_path, data_file_path)
+    Path(index_file_path).write_bytes(orjson.dumps(new_index))
+    print(f"Converted {converted} of {len(new_index)} posting lists in {data_file_path}")
+
+
+if __name__ == '__main__':
+    convert_diskdict(sys.argv[1] if len(sys.argv) > 1 else "diskdict")
@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter, OrderedDict
+
+RESULT_OVERHEAD = 120  # tuple, float and int objects of one (score, doc_id, url) result
+
+
+class QueryCache:
+    """LRU cache of search results bounded by entry count and approximate bytes.
+
+    Keys are the multiset of stemmed query terms plus top_k and any quoted
+    phrases, so queries that differ only in case, punctuation, word order or
+    inflection share an entry.
+
+    watched_paths() lists the index files. Once their mtimes or sizes have
+    changed and then stayed the same for a whole check interval (so a build
+    still writing them is not picked up half way), on_change reloads the
+    index and the cache empties itself.
+    """
+
+    def __init__(self, watched_paths=None, on_change=None, max_entries=10000, max_bytes=64 * 1024 * 1024,
+                 check_interval=1.0):
+        self.watched_paths = watched_paths or list
+        self.on_change = on_change
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0  # also the generation of the entries: see put()
+        self.lock = threading.Lock()
+
+        self.signature = self._file_signature()
+        self.pending = None  # a changed signature waiting to settle
+        self.last_check = time.monotonic()
+
+    @staticmethod
+    def make_key(stemmed_terms, top_k, phrases=()):
+        return tuple(sorted(Counter(stemmed_terms).items())), top_k, phrases
+
+    def _file_signature(self):
+        signature = []
+        for path in self.watched_paths():
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append((path, None))
+        return signature
+
+    def _check_files(self):
+        now = time.monotonic()
+        if now - self.last_check < self.check_interval:
+            return
+        self.last_check = now
+
+        signature = self._file_signature()
+        if signature == self.signature or signature != self.pending:
+            self.pending = None if signature == self.signature else signature
+            return
+
+        if self.on_change:
+            try:
+                self.on_change()
+            except Exception as e:
+                print(f"Index reload failed, retrying: {e!r}")
+                return
+        self.signature = self._file_signature()  # the reloaded index may watch other files
+        self.pending = None
+        self.entries.clear()
+        self.total_bytes = 0
+        self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def get(self, key):
+        with self.lock:
+            self._check_files()
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[0])
+
+    def put(self, key, results, generation=None):
+        """Store results, unless the index was reloaded after generation (invalidations read before evaluating)."""
+        size = sys.getsizeof(results) + sum(RESULT_OVERHEAD + len(result[2]) for result in results)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if generation is not None and generation != self.invalidations:
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+
+            self.entries[key] = (list(results), size)
+            self.total_bytes += size
+
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'invalidations': self.invalidations,
+            }
@@ -1,27 +1,116 @@
-from text_processor import tokenize, stem_words
+from text_processor import tokenize, stem_words, analyzer
 from diskdict import DiskDict
+import os
+import re
 import math
+import numpy as np
 from collections import defaultdict, Counter
 import time
 from pathlib import Path
 import orjson
 from concurrent.futures import ThreadPoolExecutor
-from heapq import heappush, heappop
-import pagerank as pr
+from heapq import heappush, heappop, heapreplace
+from bisect import bisect_left
+from doctable import DocTable, DOC_TABLE_PATH, build_doc_table
+from tiers import TIER_FILENAMES
+from query_cache import QueryCache
+from segments import SegmentedIndex, MANIFEST_PATH, DELETED_PATH
+from metrics import metrics
+from positions import POSITIONS_FILENAME, MAX_SLOP, position_doc_ids, decode_positions, phrase_matches
+from term_bounds import term_bounds_path, load_block_bounds
+from index_shards import SHARD_ENV, SHARD_MANIFEST_PATH, ShardedIdf, shard_count, shard_filename
+from posting_cache import posting_cache
 
 # Initialize global data structures
-db = DiskDict()
-db.load_top_k_words_in_cache()
-urls = defaultdict(list, orjson.loads(Path('data/url_mapping_with_pagerank.json').read_bytes()))
-#urls = {v: k for k, v in urls.items()}
-urls={value[0]: [key, value[1]] for key, value in urls.items()}
+analyzer.load()  # stem table learned by page_processor.py, so query terms start warm
 
+# In an index_shards.py worker only one shard's postings are searched; doc
+# ids, idf, norms and PageRank are still the global ones.
+shard = int(os.environ[SHARD_ENV]) if SHARD_ENV in os.environ else None
+if shard is None and shard_count():
+    raise RuntimeError(f"The index is split into shards ({SHARD_MANIFEST_PATH}); search it through index_shards.ShardCoordinator")
+index_filename = shard_filename(shard) if shard is not None else "diskdict"
+bounds_path = term_bounds_path(index_filename)
 
-idf_dict = orjson.loads(Path('data/idf_values.json').read_bytes())
-doc_norms = orjson.loads(Path('data/doc_norms.json').read_bytes())
-doc_norms = defaultdict(int, {int(k): v for k, v in doc_norms.items()})
+TF_IDF_WEIGHT = 0.7
+PAGE_RANK_WEIGHT = 0.3
+PRUNE_EPSILON = 1e-9
+FETCH_THREADS = 16
 
-pageRanks = pr.getPageRanks()
+tier_counts = Counter()
+PHRASE_PATTERN = re.compile(r'"([^"]*)"(?:~(\d+))?')
+
+
+def load_index():
+    """Open the index and everything derived from it.
+
+    Runs on import, and again from the result cache once index_files() have
+    changed. Everything is opened before any global is replaced, so a failed
+    reload leaves the previous index in use.
+    """
+    global db, idf_dict, doc_table, num_docs, doc_norm_array, page_rank_array, segmented, default_indexes
+    global doc_url, max_impacts, block_bounds, max_page_rank, tiers, positions_index
+
+    base = DiskDict(index_filename, read_only=True)
+    # With a lexicon, idf is read from it per term instead of loading idf_values.json
+    if shard is not None:
+        idf = ShardedIdf(shard_count())
+    elif base.lexicon:
+        idf = base.lexicon.column("idf")
+    else:
+        idf = orjson.loads(Path('data/idf_values.json').read_bytes())
+
+    if not Path(DOC_TABLE_PATH).exists():
+        build_doc_table()  # one-time conversion of an index built before the doc table existed
+    table = DocTable()
+    norms, ranks = table.norms, table.page_ranks
+
+    # Documents added through segments.py are searched together with the base
+    # index, under global IDF values; the base-only MaxScore bounds and tiers
+    # are then bypassed.
+    segmented_index = SegmentedIndex(base, table, idf) if Path(MANIFEST_PATH).exists() and shard is None else None
+    if segmented_index:
+        idf, norms, ranks = segmented_index.idf_dict, segmented_index.norms, segmented_index.page_ranks
+
+    # MaxScore reads the largest impact of a list from the lexicon and its block maxima from the bounds file
+    bounds = load_block_bounds(index_filename, base.lexicon)
+
+    # Tiers split the unsharded index
+    tier_dbs = [DiskDict(filename, read_only=True) for filename in TIER_FILENAMES
+                if Path('data/' + filename + '.idx').exists() and shard is None]
+
+    # Built with indexer.py --positions; without it quoted phrases are searched as plain terms
+    positions = (DiskDict(POSITIONS_FILENAME, read_only=True)
+                 if Path('data/' + POSITIONS_FILENAME + '.idx').exists() else None)
+
+    # Cached lists belong to the previous DiskDicts and would never be looked up again
+    posting_cache.clear()
+    db, idf_dict, doc_table, segmented, block_bounds, tiers, positions_index = (
+        base, idf, table, segmented_index, bounds, tier_dbs, positions)
+    max_impacts = db.lexicon.column("max_impact") if block_bounds else None
+    doc_norm_array, page_rank_array, num_docs = norms, ranks, len(norms)
+    default_indexes = segmented.indexes if segmented else (db,)
+    doc_url = segmented.url if segmented else doc_table.url
+    # Also recomputed when pagerank.py rewrites the PageRank column in place
+    max_page_rank = float(page_rank_array.max(initial=0.0))
+
+
+def index_files():
+    """The files load_index reads; the result cache reloads the index when one of them changes."""
+    paths = [db.data_file_path, db.index_file_path, db.lexicon_path, 'data/idf_values.json', DOC_TABLE_PATH,
+             bounds_path, MANIFEST_PATH, DELETED_PATH, 'data/' + POSITIONS_FILENAME + '.idx']
+    paths += ['data/' + filename + '.idx' for filename in TIER_FILENAMES]
+    if segmented:
+        paths += [segment.doc_table.path for segment in segmented.segments]
+    return paths
+
+
+load_index()
+result_cache = QueryCache(index_files, on_change=load_index)
+
+# Shared by all searches for the lifetime of the process
+executor = ThreadPoolExecutor(max_workers=FETCH_THREADS)
+MAX_BATCH_SIZE = 100
 
 def compute_query_tf(query_terms):
     term_counts = Counter(query_terms)
@@ -37,79 +126,415 @@ def cosine_similarity(doc_dot_product, doc_norm, query_norm):
         return 0.0
     return doc_dot_product / (query_norm * doc_norm)
 
-def compute_doc_scores(term, query_tfidf):
-    postings = db.get(term)
-    term_score = query_tfidf[term]
-    local_scores = defaultdict(float)
-    
-    for doc_id, tfidf_score in postings:
-        if urls[doc_id][1] > 0 :
-            local_scores[doc_id] += term_score * float(tfidf_score)
-
-    return local_scores
-
-def estimate_lower_bound(doc_score, remaining_terms, query_tfidf, doc_norm):
-    """Estimate a lower bound on the final score for pruning."""
-    max_remaining = sum(
-        query_tfidf[term] * doc_norm
-        for term in remaining_terms
-    )
-    return doc_score + max_remaining
-
-def search(query, top_k=10):
-    tokens = tokenize(query)
-    stemmed_tokens = stem_words(tokens)
+def fetch_postings(term, indexes):
+    return [index.get_arrays(term) for index in indexes]
 
-    query_tfidf = compute_query_tfidf(stemmed_tokens)
-    query_norm = math.sqrt(sum(val ** 2 for val in query_tfidf.values()))
-    
-    doc_scores = defaultdict(float)  # Accumulate dot products
-    best_scores = {}  # {doc_id: (weightedSimilarity, url)} for tracking best score per doc
-
-    tf_idf_weight = 0.7
-    page_rank_weight = 0.3
-
-    # Process terms in parallel
-    with ThreadPoolExecutor() as executor:
-        term_results = executor.map(
-            lambda term: (term, compute_doc_scores(term, query_tfidf)),
-            query_tfidf.keys()
-        )
-
-    for term, local_scores in term_results:
-        for doc_id, score in local_scores.items():
-            doc_scores[doc_id] += score 
-
-    for doc_id, score in doc_scores.items():
-        similarity = cosine_similarity(
-            doc_scores[doc_id], doc_norms[doc_id], query_norm
-        )
-        weightedSimilarity = ((similarity * tf_idf_weight) + (urls[doc_id][1] * page_rank_weight))
-        url = urls.get(doc_id, [])[0] or []
-        best_scores[doc_id] = (weightedSimilarity, url)
-
-    # Build the top-k heap from best_scores with pruning
+def select_top_k(candidates, doc_scores, query_norm, top_k):
+    """Vectorized cosine + PageRank scoring of candidate doc ids and top-k selection.
+
+    Ties on the score are broken by doc id, the same as search_maxscore.
+    """
+    denominator = query_norm * doc_norm_array[candidates]
+    similarity = np.divide(doc_scores[candidates], denominator,
+                           out=np.zeros(len(candidates)), where=denominator != 0)
+    weighted = (similarity * TF_IDF_WEIGHT) + (page_rank_array[candidates] * PAGE_RANK_WEIGHT)
+
+    if len(candidates) > top_k:
+        kth_score = weighted[np.argpartition(weighted, -top_k)[-top_k]]
+        keep = weighted >= kth_score
+        candidates, weighted = candidates[keep], weighted[keep]
+
+    order = np.lexsort((candidates, weighted))[::-1][:top_k]
+    return [(float(weighted[i]), int(candidates[i]), doc_url(int(candidates[i]))) for i in order]
+
+def essential_split(order, prefix_bounds, page_rank_bound, threshold):
+    """Number of lowest-bound terms whose documents alone cannot beat the threshold."""
+    non_essential = 0
+    while non_essential < len(order) and prefix_bounds[non_essential + 1] + page_rank_bound + PRUNE_EPSILON < threshold:
+        non_essential += 1
+    return non_essential
+
+def maxscore_terms(query_tfidf):
+    return [term for term, weight in query_tfidf.items() if weight > 0 and term in max_impacts]
+
+def search_maxscore(query_tfidf, query_norm, top_k, postings=None):
+    """MaxScore document-at-a-time evaluation, returning the same top-k as exhaustive scoring.
+
+    Terms are ordered by the most they can add to the weighted cosine score.
+    Once the heap is full, the lowest-bound terms whose combined bound plus
+    the best PageRank contribution stays under the k-th score become
+    non-essential: their lists are no longer traversed, only probed for the
+    candidates produced by the remaining (essential) lists.
+    """
+    terms = maxscore_terms(query_tfidf)
+    columns = postings
+    if columns is None:
+        with metrics.stage("fetch"):
+            columns = {term: db.get_columns(term) for term in terms}
+    for term in terms:
+        metrics.record_postings(term, len(columns[term][0]))
+    upper_bounds = {
+        term: TF_IDF_WEIGHT * query_tfidf[term] * max_impacts[term] / query_norm
+        for term in terms
+    }
+
+    order = sorted(terms, key=upper_bounds.get)
+    prefix_bounds = [0.0]
+    for term in order:
+        prefix_bounds.append(prefix_bounds[-1] + upper_bounds[term])
+
+    with metrics.stage("score"):
+        blocks = {term: block_bounds.blocks(term) for term in terms}
+        heap = _maxscore_loop(query_tfidf, query_norm, top_k, order, columns, blocks, upper_bounds, prefix_bounds)
+
+    results = [(score, doc_id, doc_url(doc_id)) for score, doc_id in heap]
+    results.sort(reverse=True)
+    return results
+
+def _maxscore_loop(query_tfidf, query_norm, top_k, order, columns, blocks, upper_bounds, prefix_bounds):
     heap = []
-    min_score = 0.0
-    for doc_id, (weightedSimilarity, url) in best_scores.items():
-        # Prune here using the final score against min_score
+    threshold = -math.inf
+    non_essential = 0
+
+    cursors = []
+    for rank, term in enumerate(order):
+        if columns[term][0]:
+            heappush(cursors, (columns[term][0][0], rank, 0))
+
+    while cursors:
+        doc_id = cursors[0][0]
+        contributions = {}
+        while cursors and cursors[0][0] == doc_id:
+            _, rank, position = heappop(cursors)
+            if rank < non_essential:
+                continue  # list became non-essential; it is probed below instead
+            term = order[rank]
+            doc_ids, scores = columns[term]
+            contributions[term] = query_tfidf[term] * scores[position]
+            if position + 1 < len(doc_ids):
+                heappush(cursors, (doc_ids[position + 1], rank, position + 1))
+
+        if not contributions:
+            continue
+
+        page_rank = float(page_rank_array[doc_id])
+        if page_rank <= 0:
+            continue
+
+        doc_norm = float(doc_norm_array[doc_id])
+        scale = TF_IDF_WEIGHT / (query_norm * doc_norm) if doc_norm else 0.0
+        partial = sum(contributions.values()) * scale + PAGE_RANK_WEIGHT * page_rank
+
+        if len(heap) == top_k:
+            remaining = prefix_bounds[non_essential]
+            if partial + remaining + PRUNE_EPSILON < threshold:
+                continue
+
+            # Probe non-essential lists from the highest bound down, tightening
+            # each term's bound to its block maximum before searching the list
+            pruned = False
+            for rank in range(non_essential - 1, -1, -1):
+                term = order[rank]
+                remaining -= upper_bounds[term]
+                block_bound = term_block_bound(blocks[term], doc_id, query_tfidf[term], query_norm)
+                if partial + remaining + block_bound + PRUNE_EPSILON < threshold:
+                    pruned = True
+                    break
+                score = lookup_posting(columns[term], doc_id)
+                if score is not None:
+                    contributions[term] = query_tfidf[term] * score
+                    partial += contributions[term] * scale
+            if pruned:
+                continue
+
+        # Sum in query term order so the score is bit-identical to search_exhaustive
+        dot_product = 0.0
+        for term in query_tfidf:
+            if term in contributions:
+                dot_product += contributions[term]
+        similarity = cosine_similarity(dot_product, doc_norm, query_norm)
+        weightedSimilarity = (similarity * TF_IDF_WEIGHT) + (page_rank * PAGE_RANK_WEIGHT)
+
         if len(heap) < top_k:
-            heappush(heap, (weightedSimilarity, doc_id, url))
-            if len(heap) == top_k:
-                min_score = heap[0][0]
-        elif weightedSimilarity > min_score:
-            heappop(heap)
-            heappush(heap, (weightedSimilarity, doc_id, url))
-            min_score = heap[0][0]
-
-    results = []
-    while heap:
-        results.append(heappop(heap))
-    results.sort(reverse=True)
+            heappush(heap, (weightedSimilarity, doc_id))
+        elif (weightedSimilarity, doc_id) > heap[0]:
+            heapreplace(heap, (weightedSimilarity, doc_id))
+        else:
+            continue
+
+        if len(heap) == top_k:
+            threshold = heap[0][0]
+            non_essential = essential_split(order, prefix_bounds, PAGE_RANK_WEIGHT * max_page_rank, threshold)
+
+    return heap
+
+def lookup_posting(columns, doc_id):
+    doc_ids, scores = columns
+    position = bisect_left(doc_ids, doc_id)
+    if position < len(doc_ids) and doc_ids[position] == doc_id:
+        return scores[position]
+    return None
+
+def term_block_bound(blocks, doc_id, term_weight, query_norm):
+    """Bound of the block of a term's list that would hold doc_id; blocks are ([last doc id], [block max])."""
+    last_doc_ids, block_maxima = blocks
+    block = bisect_left(last_doc_ids, doc_id)
+    if block == len(last_doc_ids):
+        return 0.0
+    return TF_IDF_WEIGHT * term_weight * block_maxima[block] / query_norm
+
+def parse_query(query):
+    """Stemmed query terms plus the quoted phrases as (terms, slop) pairs.
+
+    "a b" matches the terms next to each other, "a b"~N in order with at most
+    N other tokens in between. Phrase words also count as ordinary terms.
+    """
+    query = query or ""  # /search without q sends None
+    phrases = []
+    if positions_index:
+        for text, slop in PHRASE_PATTERN.findall(query):
+            terms = tuple(stem_words(tokenize(text)))
+            if len(terms) > 1:
+                phrases.append((terms, min(int(slop or 0), MAX_SLOP)))
+    stemmed_tokens = stem_words(tokenize(PHRASE_PATTERN.sub(r"\1", query)))
+    return stemmed_tokens, tuple(phrases)
+
+def search(query, top_k=10, exhaustive=False, tiered=None):
+    with metrics.query(query):
+        with metrics.stage("parse"):
+            stemmed_tokens, phrases = parse_query(query)
+        posting_cache.log_query(stemmed_tokens)
+
+        # Only the default evaluation is cached; forced modes are for comparisons
+        use_cache = not exhaustive and tiered is None
+        if use_cache:
+            with metrics.stage("result_cache"):
+                cache_key = result_cache.make_key(stemmed_tokens, top_k, phrases)
+                results = result_cache.get(cache_key)
+            if results is not None:
+                return results
+            generation = result_cache.invalidations
+
+        results = evaluate(stemmed_tokens, top_k, exhaustive, tiered, phrases)
+
+        if use_cache:
+            result_cache.put(cache_key, results, generation)
+        return results
+
+def search_batch(queries, top_k=10):
+    """Answer several queries at once, fetching each distinct term's postings only once."""
+    if len(queries) > MAX_BATCH_SIZE:
+        raise ValueError(f"At most {MAX_BATCH_SIZE} queries per batch")
+
+    results = [None] * len(queries)
+    pending = defaultdict(list)  # cache key -> positions of the queries sharing it
+    stems = {}
+    for position, query in enumerate(queries):
+        stemmed_tokens, phrases = parse_query(query)
+        posting_cache.log_query(stemmed_tokens)
+        cache_key = result_cache.make_key(stemmed_tokens, top_k, phrases)
+        if cache_key not in pending:
+            results[position] = result_cache.get(cache_key)
+            if results[position] is not None:
+                continue
+            stems[cache_key] = stemmed_tokens, phrases
+        pending[cache_key].append(position)
+
+    generation = result_cache.invalidations
+    # Each distinct term is fetched once in the form its queries' evaluation reads
+    plans = {cache_key: plan_query(*stems[cache_key]) for cache_key in pending}
+    needed = list({(method, term) for _, _, method, terms in plans.values() for term in terms})
+    fetched = dict(zip(needed, executor.map(lambda key: fetch_term_postings(key[1], key[0]), needed)))
+
+    for cache_key, positions in pending.items():
+        with metrics.query(queries[positions[0]]):
+            stemmed_tokens, phrases = stems[cache_key]
+            _, _, method, terms = plans[cache_key]
+            postings = {term: fetched[method, term] for term in terms}
+            query_results = evaluate(stemmed_tokens, top_k, phrases=phrases, postings=postings)
+        result_cache.put(cache_key, query_results, generation)
+        for position in positions:
+            results[position] = list(query_results)
+
     return results
 
+def warm_posting_cache():
+    """Prefetch postings for the terms of the logged queries, most frequent first, until the posting cache is full.
+
+    Without a query log the most common terms of the index are used instead.
+    Call it once the cache budget is set; importing this module leaves the
+    cache cold.
+    """
+    terms = posting_cache.warm_terms()
+    if not terms and Path('data/top_k_words.txt').exists():
+        terms = Path('data/top_k_words.txt').read_text().split()
+
+    rejected = posting_cache.rejected
+    for term in terms:
+        if posting_cache.full() or posting_cache.rejected > rejected:
+            break
+        prefetch_postings(term)
+    posting_cache.reset_counters()  # the hit ratio covers queries only
+
+def prefetch_postings(term):
+    if segmented:
+        for index in default_indexes:
+            index.get_arrays(term)
+    elif tiers:
+        for tier in tiers:
+            tier.get_arrays(term)
+    elif block_bounds:
+        db.get_columns(term)
+    else:
+        db.get_arrays(term)
+
+def plan_query(stemmed_tokens, phrases=(), exhaustive=False, tiered=None):
+    """Query weights, the evaluation evaluate() runs and the terms whose postings it reads.
+
+    The method is 'phrases', 'exhaustive', 'tiered' or 'maxscore'; see
+    fetch_term_postings for the form of the postings each one reads.
+    """
+    query_tfidf = compute_query_tfidf(stemmed_tokens)
+    query_norm = math.sqrt(sum(val ** 2 for val in query_tfidf.values()))
+
+    if tiered is None:
+        tiered = bool(tiers)
+    if phrases:
+        method = "phrases"
+    elif exhaustive or segmented:
+        method = "exhaustive"
+    elif tiered:
+        method = "tiered"
+    elif block_bounds and query_norm > 0:
+        method = "maxscore"
+    else:
+        method = "exhaustive"
+    terms = maxscore_terms(query_tfidf) if method == "maxscore" else list(query_tfidf)
+    return query_tfidf, query_norm, method, terms
+
+def fetch_term_postings(term, method):
+    """A term's postings as the given evaluation reads them.
+
+    MaxScore reads the columns of the base index; the tiered search reads the
+    arrays of every tier, and the others those of the default indexes.
+    """
+    if method == "maxscore":
+        return db.get_columns(term)
+    return fetch_postings(term, tiers if method == "tiered" else default_indexes)
+
+def evaluate(stemmed_tokens, top_k, exhaustive=False, tiered=None, phrases=(), postings=None):
+    """Evaluate a parsed query.
+
+    postings maps each term plan_query lists to its fetch_term_postings
+    result, as search_batch fetches them for several queries at once;
+    without it every evaluator fetches its own lists.
+    """
+    query_tfidf, query_norm, method, _ = plan_query(stemmed_tokens, phrases, exhaustive, tiered)
+
+    if method == "phrases":
+        with metrics.stage("phrases"):
+            matches = match_phrases(phrases, positions_index)
+            # Documents of segments written without positions cannot be checked and never match
+            for segment in segmented.segments if segmented else ():
+                if segment.positions:
+                    matches = np.union1d(matches, match_phrases(phrases, segment.positions))
+        return search_exhaustive(query_tfidf, query_norm, top_k, restrict=matches, postings=postings)
+    if method == "tiered":
+        return search_tiered(query_tfidf, query_norm, top_k, postings)
+    if method == "maxscore":
+        return search_maxscore(query_tfidf, query_norm, top_k, postings)
+    return search_exhaustive(query_tfidf, query_norm, top_k, postings=postings)
+
+def search_tiered(query_tfidf, query_norm, top_k, postings=None):
+    """Score the champion tier first and add the next tier only while fewer than top_k documents match.
+
+    postings, when given, holds the lists of every tier per term.
+    """
+    for tier in range(1, len(tiers) + 1):
+        tier_postings = {term: lists[:tier] for term, lists in postings.items()} if postings is not None else None
+        results = search_exhaustive(query_tfidf, query_norm, top_k, indexes=tiers[:tier], postings=tier_postings)
+        if len(results) >= top_k or tier == len(tiers):
+            tier_counts[tier] += 1
+            return results
+
+def cache_counters():
+    """Posting and result cache counters and the tier report, read when metrics are reported rather than on every lookup."""
+    counters = {}
+    for name, value in posting_cache.stats().items():
+        counters["posting_cache_" + name] = value
+    for name, value in result_cache.stats().items():
+        counters["result_cache_" + name] = value
+    if tiers:
+        report = tier_report()
+        for tier in range(1, len(tiers) + 1):
+            counters[f"tier{tier}_answered"] = report["answered_per_tier"].get(tier, 0)
+        counters["tier1_ratio"] = report["tier1_ratio"]
+    return counters
+
+def tier_report():
+    queries = sum(tier_counts.values())
+    return {
+        'queries': queries,
+        'answered_per_tier': dict(sorted(tier_counts.items())),
+        'tier1_ratio': tier_counts[1] / queries if queries else 0.0,
+    }
+
+def match_phrases(phrases, index):
+    """Sorted ids of the documents of a positional index containing every phrase.
+
+    Documents are first narrowed to those containing all phrase terms using
+    only the doc id arrays; positions are then decoded for those candidates
+    alone.
+    """
+    matches = None
+    for terms, slop in phrases:
+        blobs = {term: index.get_bytes(term) for term in set(terms)}
+        if any(blob is None for blob in blobs.values()):
+            return np.empty(0, dtype=np.int64)
+
+        candidates = matches
+        for blob in blobs.values():
+            doc_ids = position_doc_ids(blob)
+            candidates = doc_ids if candidates is None else np.intersect1d(candidates, doc_ids, assume_unique=True)
+        candidates = candidates.astype(np.int64)
+
+        decoded = {term: decode_positions(blob, candidates) for term, blob in blobs.items()}
+        keep = [phrase_matches([decoded[term][i] for term in terms], slop) for i in range(len(candidates))]
+        matches = candidates[np.array(keep, dtype=bool)]
+    return matches
+
+def search_exhaustive(query_tfidf, query_norm, top_k, indexes=None, restrict=None, postings=None):
+    """Score every document matching a term; postings, when given, maps each term to its lists in indexes."""
+    indexes = indexes or default_indexes
+    if postings is not None:
+        term_postings = [postings[term] for term in query_tfidf]
+    else:
+        # Fetch postings in parallel
+        with metrics.stage("fetch"):
+            term_postings = list(executor.map(lambda term: fetch_postings(term, indexes), query_tfidf))
+    for term, postings in zip(query_tfidf, term_postings):
+        metrics.record_postings(term, sum(len(doc_ids) for doc_ids, _ in postings))
+
+    # Accumulate dot products term by term, in query order like the scalar version did
+    with metrics.stage("score"):
+        doc_scores = np.zeros(num_docs)
+        matched = np.zeros(num_docs, dtype=bool)
+        for term, postings in zip(query_tfidf, term_postings):
+            term_score = query_tfidf[term]
+            for doc_ids, tfidf_scores in postings:
+                doc_scores[doc_ids] += term_score * tfidf_scores
+                matched[doc_ids] = True
+
+        candidates = np.flatnonzero(matched & (page_rank_array > 0))
+        if restrict is not None:
+            candidates = np.intersect1d(candidates, restrict, assume_unique=True)
+
+    with metrics.stage("select"):
+        return select_top_k(candidates, doc_scores, query_norm, top_k)
+
 
 if __name__ == '__main__':
+    warm_posting_cache()
     print("Starting query processor...")
     try:
         while True:
@@ -121,11 +546,13 @@ if __name__ == '__main__':
             
             print("\nTop results:")
             for score, doc_id, url in top_results:
-                print(f"Doc ID: {doc_id}, URL: {url}, Similarity: {score:.4f}, pageRank:{urls[doc_id][1]:.12f}")
+                print(f"Doc ID: {doc_id}, URL: {url}, Similarity: {score:.4f}, pageRank:{page_rank_array[doc_id]:.12f}")
             
             elapsed_time = end_time - start_time
             print(f"Elapsed time: {elapsed_time * 1000:.2f} ms")
 
     except KeyboardInterrupt:
         print("Exiting...")
+        if tiers:
+            print(f"Tier report: {tier_report()}")
         db.close()
\ No newline at end of file
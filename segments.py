@@ -0,0 +1,543 @@
+import os
+import sys
+import math
+import fcntl
+import shutil
+import argparse
+import functools
+import subprocess
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import orjson
+from rocksdict import Rdict
+
+from diskdict import DiskDict
+from lexicon import build_lexicon
+from term_bounds import stored_max_impacts
+from index_builder import IndexBuilder
+from indexer import compute_tf, document_sections
+from doctable import DocTable, write_doc_table, update_page_ranks
+from positions import POSITIONS_FILENAME, PositionBuilder, decode_all
+from shards import is_shard_path, read_documents as read_shard_documents
+
+SEGMENT_DIR = 'data/segments'
+MANIFEST_PATH = SEGMENT_DIR + '/manifest.json'
+DELETED_PATH = SEGMENT_DIR + '/deleted.bin'
+LOCK_PATH = SEGMENT_DIR + '/lock'
+URL_IDS_PATH = SEGMENT_DIR + '/url_ids'  # URL -> global doc id
+DF_PATH = SEGMENT_DIR + '/df'  # term -> df over the base index and the segments
+STORE_VERSION_KEY = "__version__"
+MERGE_FACTOR = 10  # segments of one level that are merged into one of the next level
+
+# A segment holds the documents of one ingest batch (or of merged batches) in
+# data/segments/<name>/:
+#   postings.dat/.idx  raw weighted TF postings over global doc ids (IDF is applied at query time)
+#   docs.jsonl         [doc_id, url, tf items] per document, to recompute norms and df on merge
+#   df.json            document frequency of every term in the segment
+#   doctable.bin       norms, PageRanks and URLs of the doc id range [first_doc, end_doc)
+#   positions.dat/.idx token positions, when the base index was built with --positions
+#
+# The manifest lists the live segments; deleted.bin is one tombstone bit per
+# global doc id, covering the base index as well. Like in Lucene, df and the
+# document count still include deleted documents until a merge drops them
+# (deleted base documents only leave the statistics on a full rebuild).
+#
+# url_ids and df are RocksDB stores kept up to date by every ingest and merge,
+# so an ingest reads only the URLs and terms of its own batch.
+
+
+def _empty_manifest():
+    doc_table = DocTable()
+    page_ranks = doc_table.page_ranks[doc_table.page_ranks > 0]
+    return {
+        "base_docs": len(doc_table),
+        "next_doc_id": len(doc_table),
+        "next_segment": 0,
+        # New documents rank like a median page until pagerank.py --incremental scores them
+        "provisional_page_rank": float(np.median(page_ranks)) if len(page_ranks) else 1.0,
+        "segments": [],
+    }
+
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return _empty_manifest()
+    return orjson.loads(Path(MANIFEST_PATH).read_bytes())
+
+
+def _write_atomic(path, data):
+    tmp_path = path + ".tmp"
+    Path(tmp_path).write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def load_deleted(num_docs):
+    deleted = np.zeros(num_docs, dtype=bool)
+    if os.path.exists(DELETED_PATH):
+        bits = np.unpackbits(np.fromfile(DELETED_PATH, dtype=np.uint8))
+        deleted[:min(len(bits), num_docs)] = bits[:num_docs].astype(bool)
+    return deleted
+
+
+def _locked(func):
+    """Run func holding the segment directory lock, so ingest, delete and merge never interleave."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        os.makedirs(SEGMENT_DIR, exist_ok=True)
+        with open(LOCK_PATH, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def segment_path(name, filename=""):
+    return os.path.join(SEGMENT_DIR, name, filename)
+
+
+def positional():
+    """Whether the base index has positions, so segments need them for phrase queries too."""
+    return os.path.exists('data/' + POSITIONS_FILENAME + '.idx')
+
+
+def segment_positions(name):
+    return PositionBuilder(os.path.join("segments", name, POSITIONS_FILENAME),
+                           run_dir=segment_path(name, "position_runs"))
+
+
+def base_df(base_docs):
+    """Document frequencies of the base index, read from its lexicon.
+
+    A term in every base document has an IDF of 0 and no postings, so it is
+    not in the lexicon; its df is base_docs.
+    """
+    db = DiskDict(read_only=True)
+    if db.lexicon is None:
+        db.close()
+        build_lexicon("diskdict", stored_max_impacts())  # one-time conversion of an index built before the lexicon
+        db = DiskDict(read_only=True)
+    df = dict(zip(db.lexicon, db.lexicon.entries["df"].tolist()))
+    db.close()
+
+    idf_values = orjson.loads(Path('data/idf_values.json').read_bytes())
+    df.update((term, base_docs) for term, idf in idf_values.items() if idf == 0 and term not in df)
+    return df
+
+
+def global_stats(manifest):
+    """Total document count and df over the base index and every segment."""
+    df = defaultdict(int, base_df(manifest["base_docs"]))
+    total_docs = manifest["base_docs"]
+    for segment in manifest["segments"]:
+        total_docs += segment["num_docs"]
+        for term, count in orjson.loads(Path(segment_path(segment["name"], "df.json")).read_bytes()).items():
+            df[term] += count
+    return df, total_docs
+
+
+def compute_idf(df, total_docs):
+    return {term: math.log10(total_docs / count) for term, count in df.items() if count > 0}
+
+
+def url_lookup(manifest):
+    """URL -> global doc id of every document in the base index and the segments."""
+    urls = orjson.loads(Path('data/url_mapping.json').read_bytes())
+    for segment in manifest["segments"]:
+        doc_table = DocTable(segment_path(segment["name"], "doctable.bin"))
+        for local_id in range(len(doc_table)):
+            url = doc_table.url(local_id)
+            if url:
+                urls[url] = segment["first_doc"] + local_id
+    return urls
+
+
+def store_version(manifest):
+    return f"{manifest['base_docs']}:{manifest['next_segment']}"
+
+
+class SegmentStores:
+    """The url_ids and df stores, rebuilt from the base index and the segments when they do not match the manifest.
+
+    The version stamp is written last, so an ingest or merge interrupted
+    between the manifest and the stores leaves them to be rebuilt.
+    """
+
+    def __init__(self, manifest):
+        self.url_ids = Rdict(URL_IDS_PATH)
+        self.df = Rdict(DF_PATH)
+        if self.df.get(STORE_VERSION_KEY) != store_version(manifest):
+            self._rebuild(manifest)
+
+    def _rebuild(self, manifest):
+        self.close()
+        Rdict.destroy(URL_IDS_PATH)
+        Rdict.destroy(DF_PATH)
+        self.url_ids = Rdict(URL_IDS_PATH)
+        self.df = Rdict(DF_PATH)
+        for url, doc_id in url_lookup(manifest).items():
+            self.url_ids[url] = doc_id
+        for term, count in global_stats(manifest)[0].items():
+            self.df[term] = count
+        self.df[STORE_VERSION_KEY] = store_version(manifest)
+
+    def document_frequencies(self, terms):
+        return defaultdict(int, {term: self.df.get(term, 0) for term in terms})
+
+    def update(self, manifest, url_ids, df):
+        for url, doc_id in url_ids.items():
+            self.url_ids[url] = doc_id
+        for term, count in df.items():
+            self.df[term] = count
+        self.df[STORE_VERSION_KEY] = store_version(manifest)
+
+    def close(self):
+        self.url_ids.close()
+        self.df.close()
+
+
+def total_documents(manifest):
+    return manifest["base_docs"] + sum(segment["num_docs"] for segment in manifest["segments"])
+
+
+def write_segment(name, first_doc, docs, idf_dict, page_ranks, positions=None):
+    """Write a segment from (doc_id, url, tf) triples in ascending doc id order, starting at first_doc.
+
+    positions is the segment's PositionBuilder, already holding the positions
+    of the documents; it is closed here.
+    """
+    os.makedirs(segment_path(name), exist_ok=True)
+    postings = IndexBuilder(os.path.join("segments", name, "postings"),
+                            run_dir=segment_path(name, "runs"), quantized=False)
+    df = defaultdict(int)
+    norms, urls = {}, {}
+
+    with open(segment_path(name, "docs.jsonl"), "wb") as doc_file:
+        for doc_id, url, tf in docs:
+            for term, value in tf.items():
+                postings.put(term, doc_id, value)
+                df[term] += 1
+            norms[doc_id - first_doc] = math.sqrt(sum((value * idf_dict.get(term, 0)) ** 2 for term, value in tf.items()))
+            urls[doc_id - first_doc] = url
+            doc_file.write(orjson.dumps([doc_id, url, list(tf.items())]) + b"\n")
+
+    postings.close()
+    os.rmdir(segment_path(name, "runs"))
+    Path(segment_path(name, "df.json")).write_bytes(orjson.dumps(df))
+    write_doc_table(docs[-1][0] + 1 - first_doc, norms,
+                    {doc_id - first_doc: page_ranks[doc_id] for doc_id, _, _ in docs}, urls,
+                    path=segment_path(name, "doctable.bin"))
+    if positions:
+        positions.close()
+        os.rmdir(positions.run_dir)
+    return df
+
+
+def read_documents(paths):
+    """Yield (url, sections) of the processed files or shards under the given files or directories."""
+    for path in paths:
+        if is_shard_path(path):
+            yield from read_shard_documents(path)
+            continue
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = sorted(os.path.join(root, f) for root, _, fs in os.walk(path) for f in fs if f.endswith(".json"))
+        for file_path in files:
+            data = orjson.loads(Path(file_path).read_bytes())
+            yield data.get("url", ""), document_sections(data)
+
+
+def _tombstone(deleted, doc_ids):
+    for doc_id in doc_ids:
+        deleted[doc_id] = True
+    _write_atomic(DELETED_PATH, np.packbits(deleted).tobytes())
+
+
+@_locked
+def add_documents(paths):
+    """Index a batch of processed files as a new segment.
+
+    A URL that is already indexed is replaced: the old document is
+    tombstoned and the new version gets a fresh doc id.
+    """
+    manifest = load_manifest()
+    stores = SegmentStores(manifest)
+    try:
+        return _add_documents(paths, manifest, stores)
+    finally:
+        stores.close()
+
+
+def _add_documents(paths, manifest, stores):
+    name = f"seg_{manifest['next_segment']:05d}"
+    positions = segment_positions(name) if positional() else None
+    urls = {}  # the batch's URLs
+    docs = []
+    replaced = []
+    doc_id = manifest["next_doc_id"]
+    for url, sections in read_documents(paths):
+        old_id = urls.get(url, stores.url_ids.get(url))
+        if old_id is not None:
+            replaced.append(old_id)
+        urls[url] = doc_id
+        docs.append((doc_id, url, compute_tf(sections)))
+        if positions:
+            positions.add_document(doc_id, sections)
+        doc_id += 1
+    if not docs:
+        shutil.rmtree(segment_path(name), ignore_errors=True)
+        return 0
+
+    deleted = load_deleted(doc_id)
+    replaced = [old_id for old_id in replaced if not deleted[old_id]]
+
+    df = stores.document_frequencies({term for _, _, tf in docs for term in tf})
+    for _, _, tf in docs:
+        for term in tf:
+            df[term] += 1
+    idf_dict = compute_idf(df, total_documents(manifest) + len(docs))
+
+    provisional = defaultdict(lambda: manifest["provisional_page_rank"])
+    write_segment(name, docs[0][0], docs, idf_dict, provisional, positions)
+
+    manifest["segments"].append({"name": name, "first_doc": docs[0][0], "end_doc": doc_id,
+                                 "num_docs": len(docs), "level": 0})
+    manifest["next_doc_id"] = doc_id
+    manifest["next_segment"] += 1
+    _tombstone(deleted, replaced)
+    _write_atomic(MANIFEST_PATH, orjson.dumps(manifest))
+    stores.update(manifest, urls, df)
+
+    print(f"Added {len(docs)} documents as {name} ({len(replaced)} replaced)")
+    return len(docs)
+
+
+@_locked
+def delete_documents(urls_to_delete):
+    manifest = load_manifest()
+    stores = SegmentStores(manifest)
+    doc_ids = [doc_id for doc_id in map(stores.url_ids.get, urls_to_delete) if doc_id is not None]
+    stores.close()
+    _tombstone(load_deleted(manifest["next_doc_id"]), doc_ids)
+    print(f"Deleted {len(doc_ids)} of {len(urls_to_delete)} documents")
+
+
+def find_merge(segments, merge_factor=MERGE_FACTOR):
+    """Positions of the first run of merge_factor adjacent segments of the same level, or None.
+
+    Only adjacent segments are merged so every segment keeps a contiguous doc
+    id range; this is a log-structured policy, each document is rewritten once
+    per level.
+    """
+    for start in range(len(segments) - merge_factor + 1):
+        window = segments[start:start + merge_factor]
+        if all(segment["level"] == window[0]["level"] for segment in window):
+            return start, start + merge_factor
+    return None
+
+
+@_locked
+def merge_segments(merge_factor=MERGE_FACTOR, force=False):
+    """Apply the merge policy until no merge is due; force merges all segments into one.
+
+    Merging drops tombstoned documents and recomputes norms with the current
+    global statistics.
+    """
+    merges = 0
+    while True:
+        manifest = load_manifest()
+        segments = manifest["segments"]
+        span = (0, len(segments)) if force and len(segments) > 1 else find_merge(segments, merge_factor)
+        if span is None or (force and merges):
+            return merges
+
+        start, end = span
+        merged = segments[start:end]
+        deleted = load_deleted(manifest["next_doc_id"])
+        page_ranks = {}
+        docs = []
+        merged_df = defaultdict(int)
+        for segment in merged:
+            for term, count in orjson.loads(Path(segment_path(segment["name"], "df.json")).read_bytes()).items():
+                merged_df[term] += count
+            doc_table = DocTable(segment_path(segment["name"], "doctable.bin"))
+            with open(segment_path(segment["name"], "docs.jsonl"), "rb") as doc_file:
+                for line in doc_file:
+                    doc_id, url, tf_items = orjson.loads(line)
+                    if not deleted[doc_id]:
+                        docs.append((doc_id, url, dict(tf_items)))
+                        page_ranks[doc_id] = float(doc_table.page_ranks[doc_id - segment["first_doc"]])
+
+        # Statistics without the merged segments, plus the documents that survive
+        stores = SegmentStores(manifest)
+        df = stores.document_frequencies(merged_df)
+        for term, count in merged_df.items():
+            df[term] -= count
+        for _, _, tf in docs:
+            for term in tf:
+                df[term] += 1
+        idf_dict = compute_idf(df, total_documents(manifest) - sum(segment["num_docs"] for segment in merged)
+                               + len(docs))
+
+        name = f"seg_{manifest['next_segment']:05d}"
+        replacement = []
+        if docs:
+            positions = merge_positions(name, merged, deleted) if positional() else None
+            write_segment(name, merged[0]["first_doc"], docs, idf_dict, page_ranks, positions)
+            replacement = [{"name": name, "first_doc": merged[0]["first_doc"], "end_doc": merged[-1]["end_doc"],
+                            "num_docs": len(docs), "level": max(segment["level"] for segment in merged) + 1}]
+
+        manifest["segments"] = segments[:start] + replacement + segments[end:]
+        manifest["next_segment"] += 1
+        _write_atomic(MANIFEST_PATH, orjson.dumps(manifest))
+        stores.update(manifest, {}, df)
+        stores.close()
+        for segment in merged:
+            shutil.rmtree(segment_path(segment["name"]))
+
+        merges += 1
+        print(f"Merged {len(merged)} segments into {name} ({len(docs)} live documents)")
+
+
+def merge_positions(name, merged, deleted):
+    """A PositionBuilder for segment name holding the positions of the live documents of the merged segments.
+
+    Segments written without positions contribute none, so their documents
+    still do not match phrases after the merge.
+    """
+    positions = segment_positions(name)
+    for segment in merged:
+        filename = os.path.join("segments", segment["name"], POSITIONS_FILENAME)
+        if not os.path.exists("data/" + filename + ".idx"):
+            continue
+        segment_positions_index = DiskDict(filename, read_only=True)
+        for term in segment_positions_index.disk_index:
+            documents = [(doc_id, document_positions)
+                         for doc_id, document_positions in decode_all(segment_positions_index.get_bytes(term))
+                         if not deleted[doc_id]]
+            positions.add_postings(term, documents)
+    return positions
+
+
+def update_segment_page_ranks(page_ranks):
+    """Set the PageRank of segment documents from a url -> score dict."""
+    for segment in load_manifest()["segments"]:
+        path = segment_path(segment["name"], "doctable.bin")
+        doc_table = DocTable(path)
+        ranks = {local_id: float(doc_table.page_ranks[local_id]) for local_id in range(len(doc_table))}
+        for local_id in ranks:
+            url = doc_table.url(local_id)
+            if url in page_ranks:
+                ranks[local_id] = page_ranks[url]
+        update_page_ranks(ranks, path)
+
+
+class ScaledIndex:
+    """Base index postings with their build-time IDF replaced by the global one.
+
+    Only the postings are rescaled: base documents keep the norms of their
+    build, so their cosine scores drift as segments shift the IDF values
+    (a few percent with a tenth of the documents in segments) until the
+    next full indexer.py run.
+    """
+
+    def __init__(self, db, build_idf, idf_dict):
+        self.db = db
+        self.build_idf = build_idf
+        self.idf_dict = idf_dict
+
+    def get_arrays(self, term):
+        doc_ids, scores = self.db.get_arrays(term)
+        build_idf = self.build_idf.get(term, 0)
+        idf = self.idf_dict.get(term, 0)
+        if build_idf == idf or not build_idf:
+            return doc_ids, scores
+        return doc_ids, scores * (idf / build_idf)
+
+
+class Segment:
+    def __init__(self, info, idf_dict):
+        self.first_doc = info["first_doc"]
+        self.postings = DiskDict(os.path.join("segments", info["name"], "postings"), read_only=True, quantized=False)
+        self.doc_table = DocTable(segment_path(info["name"], "doctable.bin"))
+        self.idf_dict = idf_dict
+        filename = os.path.join("segments", info["name"], POSITIONS_FILENAME)
+        self.positions = DiskDict(filename, read_only=True) if os.path.exists("data/" + filename + ".idx") else None
+
+    def get_arrays(self, term):
+        doc_ids, tfs = self.postings.get_arrays(term)
+        return doc_ids, tfs * self.idf_dict.get(term, 0)
+
+    def url(self, doc_id):
+        return self.doc_table.url(doc_id - self.first_doc)
+
+
+class SegmentedIndex:
+    """Read-only view over the base index and the segments, with global IDF and tombstones applied."""
+
+    def __init__(self, db, doc_table, build_idf):
+        manifest = load_manifest()
+        df, total_docs = global_stats(manifest)
+        self.idf_dict = compute_idf(df, total_docs)
+        self.segments = [Segment(info, self.idf_dict) for info in manifest["segments"]]
+        self.indexes = (ScaledIndex(db, build_idf, self.idf_dict),) + tuple(self.segments)
+        self.base_docs = manifest["base_docs"]
+        self.doc_table = doc_table
+
+        # Per-document arrays over all global doc ids. Deleted documents get
+        # a PageRank of 0, which every evaluator already skips.
+        num_docs = manifest["next_doc_id"]
+        self.norms = np.zeros(num_docs)
+        self.page_ranks = np.zeros(num_docs)
+        self.norms[:len(doc_table)] = doc_table.norms
+        self.page_ranks[:len(doc_table)] = doc_table.page_ranks
+        for segment in self.segments:
+            end = segment.first_doc + len(segment.doc_table)
+            self.norms[segment.first_doc:end] = segment.doc_table.norms
+            self.page_ranks[segment.first_doc:end] = segment.doc_table.page_ranks
+        self.page_ranks[load_deleted(num_docs)] = 0.0
+        self.segment_starts = [segment.first_doc for segment in self.segments]
+
+    def url(self, doc_id):
+        if doc_id < self.base_docs:
+            return self.doc_table.url(doc_id)
+        position = np.searchsorted(self.segment_starts, doc_id, side="right") - 1
+        return self.segments[position].url(doc_id)
+
+
+def status():
+    manifest = load_manifest()
+    deleted = load_deleted(manifest["next_doc_id"])
+    print(f"Base documents: {manifest['base_docs']}, next doc id: {manifest['next_doc_id']}, "
+          f"tombstones: {int(deleted.sum())}")
+    for segment in manifest["segments"]:
+        print(f"  {segment['name']}: level {segment['level']}, doc ids [{segment['first_doc']}, "
+              f"{segment['end_doc']}), {segment['num_docs']} documents")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Incremental indexing into segments on top of the base index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add_parser = commands.add_parser("add", help="index processed files, shards or directories as a new segment")
+    add_parser.add_argument("paths", nargs="+")
+    add_parser.add_argument("--no-merge", action="store_true", help="do not start a background merge afterwards")
+    delete_parser = commands.add_parser("delete", help="tombstone documents by URL")
+    delete_parser.add_argument("urls", nargs="+")
+    merge_parser = commands.add_parser("merge", help="run the merge policy")
+    merge_parser.add_argument("--all", action="store_true", help="merge all segments into one")
+    merge_parser.add_argument("--merge-factor", type=int, default=MERGE_FACTOR)
+    commands.add_parser("status")
+    args = parser.parse_args()
+
+    if args.command == "add":
+        if add_documents(args.paths) and not args.no_merge:
+            # The merge runs in its own process; it takes the lock, so the next
+            # ingest waits for it instead of interleaving
+            subprocess.Popen([sys.executable, __file__, "merge"], start_new_session=True)
+    elif args.command == "delete":
+        delete_documents(args.urls)
+    elif args.command == "merge":
+        merge_segments(args.merge_factor, force=args.all)
+    else:
+        status()
@@ -1,8 +1,39 @@
-from flask import Flask, request, jsonify, render_template
-from query_processor import search
+from flask import Flask, Response, request, jsonify, render_template
+from index_shards import ShardCoordinator, shard_count
+from metrics import metrics
+from posting_cache import posting_cache, POSTING_CACHE_BYTES, QUERY_LOG_PATH
+from completion import Completions, COMPLETIONS_PATH
+from werkzeug.serving import make_server
+import argparse
+import os
+import signal
+import socket
 import time
 
 app = Flask(__name__)
+# Built by indexer.py (or python completion.py); /suggest answers nothing without it
+completions = Completions.load() if os.path.exists(COMPLETIONS_PATH) else None
+MAX_SUGGESTIONS = 10
+MAX_TOP_K = 100
+
+# An index built with indexer.py --index-shards is searched by one worker
+# process per shard, started in each serving process by start_shard_workers;
+# otherwise the index is loaded here, on import.
+sharded = shard_count() > 0
+coordinator = None
+if not sharded:
+    from query_processor import search, search_batch, result_cache, cache_counters, warm_posting_cache, MAX_BATCH_SIZE
+
+    def cache_stats():
+        return dict(result_cache.stats(), posting_cache=posting_cache.stats())
+
+def start_shard_workers(replicas, cache_bytes, query_log_path):
+    """Route this process's searches through its own shard workers; their pipes cannot be shared across a fork."""
+    global coordinator, search, search_batch, cache_stats, cache_counters, MAX_BATCH_SIZE
+    coordinator = ShardCoordinator(replicas=replicas, cache_bytes=cache_bytes, query_log_path=query_log_path)
+    search, search_batch = coordinator.search, coordinator.search_batch
+    cache_stats, cache_counters = coordinator.cache_stats, coordinator.cache_counters
+    MAX_BATCH_SIZE = coordinator.max_batch_size
 
 @app.route('/')
 def index():
@@ -21,5 +52,115 @@ def search_endpoint():
         'time': (end_time - start_time) * 1000 # milliseconds
     })
 
+@app.route('/suggest', methods=['GET'])
+def suggest_endpoint():
+    query = request.args.get('q', '')
+    limit = max(0, min(request.args.get('limit', MAX_SUGGESTIONS, type=int), MAX_SUGGESTIONS))
+
+    with metrics.stage('suggest'):
+        suggestions = completions.suggest(query, limit) if completions else []
+
+    return jsonify({'suggestions': suggestions})
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch_endpoint():
+    body = request.get_json(silent=True) or {}
+    queries = body.get('queries')
+    top_k = body.get('top_k', 5)
+
+    if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+        return jsonify({'error': 'expected {"queries": [...]}'}), 400
+    if len(queries) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'at most {MAX_BATCH_SIZE} queries per batch'}), 400
+    if type(top_k) is not int or not 1 <= top_k <= MAX_TOP_K:
+        return jsonify({'error': f'top_k must be an integer from 1 to {MAX_TOP_K}'}), 400
+
+    start_time = time.time()
+    results = search_batch(queries, top_k=top_k)
+    end_time = time.time()
+
+    return jsonify({
+        'results': [[result[2] for result in query_results] for query_results in results],
+        'time': (end_time - start_time) * 1000 # milliseconds
+    })
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats_endpoint():
+    return jsonify(cache_stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Each pre-forked worker keeps its own metrics, labelled with its pid
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.snapshot(cache_counters()))
+    return Response(metrics.prometheus(cache_counters()), mimetype='text/plain; version=0.0.4')
+
+def serve(host, port, workers, init_worker=None):
+    """Pre-fork serving: one listening socket shared by several threaded worker processes.
+
+    The index is loaded once on import, before forking, so the workers share
+    its memory-mapped files and read-only pages. init_worker, if given, runs
+    in each worker after the fork.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(1024)
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            if init_worker:
+                init_worker()
+            server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+            server.serve_forever()
+            os._exit(0)
+        children.append(pid)
+
+    print(f"Serving on http://{host}:{port} with {workers} worker processes")
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+    finally:
+        listener.close()
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of pre-forked worker processes (default: Flask debug server)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--slow-query-ms', type=float,
+                        help='append queries slower than this to data/slow_queries.jsonl')
+    parser.add_argument('--posting-cache-mb', type=float,
+                        help='memory budget of the decoded posting cache (default: 256)')
+    parser.add_argument('--query-log', action='store_true',
+                        help=f'append the terms of every query to {QUERY_LOG_PATH} to warm the posting cache on the next start')
+    parser.add_argument('--shard-replicas', type=int, default=1,
+                        help='worker processes per index shard, for a sharded index')
+    args = parser.parse_args()
+
+    metrics.slow_query_ms = args.slow_query_ms
+    cache_bytes = int(args.posting_cache_mb * 1024 * 1024) if args.posting_cache_mb is not None else POSTING_CACHE_BYTES
+    query_log_path = QUERY_LOG_PATH if args.query_log else None
+    init_worker = None
+    if sharded:
+        init_worker = lambda: start_shard_workers(args.shard_replicas, cache_bytes, query_log_path)
+    else:
+        posting_cache.resize(cache_bytes)
+        posting_cache.query_log_path = query_log_path
+        # Warmed under the final budget and before forking, so the workers share the warm lists
+        warm_posting_cache()
+
+    if args.workers:
+        serve(args.host, args.port, args.workers, init_worker)
+    else:
+        if init_worker:
+            init_worker()
+        # The reloader would run a second copy of the shard workers in its watcher process
+        app.run(debug=True, host=args.host, port=args.port, use_reloader=not sharded)
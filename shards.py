@@ -0,0 +1,263 @@
+import os
+import struct
+import argparse
+
+import numpy as np
+import orjson
+from tqdm import tqdm
+
+SHARD_DIR = 'data/shards'
+PROCESSED_FILES_DIR = 'data/processed_files'
+CORPUS_MARKER_PATH = 'data/corpus_format'  # which of the two the last page_processor.py run wrote
+READ_BUFFER_BYTES = 1024 * 1024
+SHARD_BYTES = 64 * 1024 * 1024  # a writer starts the next shard once the current one is this large
+BATCH_BYTES = 8 * 1024 * 1024  # records are buffered and written in batches of this size
+
+# Same order as indexer.document_sections; the TF sums depend on it
+SECTIONS = ("title", "bold", "h1", "h2", "h3", "h4", "h5", "h6", "other_text")
+
+# A shard is a pair of append-only files, <n>.docs and <n>.anchors. Both start
+# with a <4sBB header (magic, format version, flags) followed by records, each
+# a <BI (kind, payload length) prefix and the payload. All integers are
+# little-endian.
+#
+#   DOCUMENT  <I url length> url, then per section in SECTIONS <I length> tokens,
+#             the tokens being space-separated stems, or <u4 term ids with FLAG_TERM_IDS
+#   TERMS     newline-separated terms that take the next term ids of the shard,
+#             written before the first document that uses them
+#   ANCHORS   orjson [url, anchors], in the .anchors file
+#
+# Every field is length-prefixed, so a reader skips the sections it does not
+# need without decoding them, and link analysis never reads the .docs files.
+FORMAT_VERSION = 1
+MAGIC = b"SHRD"
+FLAG_TERM_IDS = 1
+DOCUMENT, TERMS, ANCHORS = 1, 2, 3
+
+_HEADER = struct.Struct("<4sBB")
+_RECORD = struct.Struct("<BI")
+_LENGTH = struct.Struct("<I")
+
+
+def shard_files(path, suffix):
+    """The shard files with the given suffix at path (a shard file or a shard directory), in shard order."""
+    if os.path.isfile(path):
+        base, extension = os.path.splitext(path)
+        return [base + suffix] if extension in (".docs", ".anchors") else []
+    if not os.path.isdir(path):
+        return []
+    return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(suffix))
+
+
+def is_shard_path(path):
+    return bool(shard_files(path, ".docs"))
+
+
+def set_corpus_path(path):
+    """Record which corpus the last page_processor.py run (or conversion) wrote."""
+    os.makedirs(os.path.dirname(CORPUS_MARKER_PATH), exist_ok=True)
+    with open(CORPUS_MARKER_PATH, "w") as f:
+        f.write(path)
+
+
+def corpus_path():
+    """The corpus recorded by set_corpus_path.
+
+    Data written before the marker existed falls back to data/shards when it
+    holds shards and the per-document JSON files otherwise.
+    """
+    if os.path.exists(CORPUS_MARKER_PATH):
+        with open(CORPUS_MARKER_PATH) as f:
+            return f.read().strip()
+    return SHARD_DIR if is_shard_path(SHARD_DIR) else PROCESSED_FILES_DIR
+
+
+def _records(file_path):
+    """Yield (flags, kind, payload) of every record, reading the file one record at a time."""
+    with open(file_path, "rb", buffering=READ_BUFFER_BYTES) as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            print(f"Ignoring {file_path}: the writer stopped before its header was complete")
+            return
+        magic, version, flags = _HEADER.unpack(header)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{file_path} is not a version {FORMAT_VERSION} shard")
+
+        while True:
+            prefix = f.read(_RECORD.size)
+            if not prefix:
+                return
+            payload = b""
+            if len(prefix) == _RECORD.size:
+                kind, length = _RECORD.unpack(prefix)
+                payload = f.read(length)
+            if len(prefix) < _RECORD.size or len(payload) < length:
+                # A writer stopped mid-batch; everything before the torn record is intact
+                print(f"Ignoring a truncated record at the end of {file_path}")
+                return
+            yield flags, kind, payload
+
+
+def read_documents(path, sections=SECTIONS):
+    """Yield (url, {section: tokens}) of every document in the shards, decoding only the given sections."""
+    for file_path in shard_files(path, ".docs"):
+        vocabulary = []
+        for flags, kind, payload in _records(file_path):
+            if kind == TERMS:
+                vocabulary.extend(payload.decode().split("\n"))
+                continue
+
+            (url_length,) = _LENGTH.unpack_from(payload)
+            offset = _LENGTH.size + url_length
+            url = payload[_LENGTH.size:offset].decode()
+
+            tokens = {}
+            for section in SECTIONS:
+                (length,) = _LENGTH.unpack_from(payload, offset)
+                offset += _LENGTH.size
+                if section in sections:
+                    field = payload[offset:offset + length]
+                    if flags & FLAG_TERM_IDS:
+                        tokens[section] = [vocabulary[term_id] for term_id in np.frombuffer(field, dtype="<u4").tolist()]
+                    else:
+                        tokens[section] = field.decode().split()
+                offset += length
+            yield url, tokens
+
+
+def read_anchors(path):
+    """Yield (url, anchors) of every document in the shards."""
+    for file_path in shard_files(path, ".anchors"):
+        for _, _, payload in _records(file_path):
+            url, anchors = orjson.loads(payload)
+            yield url, anchors
+
+
+class ShardWriter:
+    """Appends processed documents to shard files in data/shards.
+
+    Unless append is set, shards already in the directory are removed first,
+    so a new run replaces the corpus instead of adding to it.
+    """
+
+    def __init__(self, directory=SHARD_DIR, term_ids=False, append=False,
+                 shard_bytes=SHARD_BYTES, batch_bytes=BATCH_BYTES):
+        self.directory = directory
+        self.flags = FLAG_TERM_IDS if term_ids else 0
+        self.shard_bytes = shard_bytes
+        self.batch_bytes = batch_bytes
+
+        os.makedirs(directory, exist_ok=True)
+        existing = shard_files(directory, ".docs") + shard_files(directory, ".anchors")
+        if not append:
+            for file_path in existing:
+                os.remove(file_path)
+            existing = []
+        self.next_shard = max((int(os.path.basename(p).split(".")[0]) + 1 for p in existing), default=0)
+
+        self.docs_file = None
+        self.anchors_file = None
+        self.documents = 0
+
+    def _open_shard(self):
+        self._close_shard()
+        base = os.path.join(self.directory, f"{self.next_shard:05d}")
+        self.next_shard += 1
+        header = _HEADER.pack(MAGIC, FORMAT_VERSION, self.flags)
+        self.docs_file = open(base + ".docs", "wb")
+        self.anchors_file = open(base + ".anchors", "wb")
+        self.docs_buffer = bytearray(header)
+        self.anchors_buffer = bytearray(header)
+        self.shard_size = 0
+        self.vocabulary = {}
+
+    def add(self, content_dict):
+        if self.docs_file is None or self.shard_size + len(self.docs_buffer) >= self.shard_bytes:
+            self._open_shard()
+
+        url = (content_dict.get("url") or "").encode()
+        fields = [_LENGTH.pack(len(url)), url]
+        for section in SECTIONS:
+            tokens = content_dict.get(section, [])
+            if self.flags & FLAG_TERM_IDS:
+                field = self._term_ids(tokens).tobytes()
+            else:
+                field = " ".join(tokens).encode()
+            fields.append(_LENGTH.pack(len(field)))
+            fields.append(field)
+        self._append(self.docs_buffer, DOCUMENT, b"".join(fields))
+
+        anchors = orjson.dumps([content_dict.get("url") or "", content_dict.get("anchor", [])])
+        self._append(self.anchors_buffer, ANCHORS, anchors)
+        self.documents += 1
+
+        if len(self.docs_buffer) + len(self.anchors_buffer) >= self.batch_bytes:
+            self._flush()
+
+    def _term_ids(self, tokens):
+        new_terms = [term for term in dict.fromkeys(tokens) if term not in self.vocabulary]
+        if new_terms:
+            for term in new_terms:
+                self.vocabulary[term] = len(self.vocabulary)
+            self._append(self.docs_buffer, TERMS, "\n".join(new_terms).encode())
+        return np.array([self.vocabulary[term] for term in tokens], dtype="<u4")
+
+    @staticmethod
+    def _append(buffer, kind, payload):
+        buffer += _RECORD.pack(kind, len(payload))
+        buffer += payload
+
+    def _flush(self):
+        self.shard_size += len(self.docs_buffer) + len(self.anchors_buffer)
+        self.docs_file.write(self.docs_buffer)
+        self.anchors_file.write(self.anchors_buffer)
+        self.docs_buffer = bytearray()
+        self.anchors_buffer = bytearray()
+
+    def _close_shard(self):
+        if self.docs_file is None:
+            return
+        self._flush()
+        self.docs_file.close()
+        self.anchors_file.close()
+        self.docs_file = self.anchors_file = None
+
+    def close(self):
+        self._close_shard()
+
+
+def convert(input_directory, output_directory=SHARD_DIR, term_ids=False):
+    """Copy a directory of per-document JSON files into shards, in the order indexer.py reads them."""
+    writer = ShardWriter(output_directory, term_ids=term_ids)
+    for filename in tqdm(os.listdir(input_directory), desc="Converting"):
+        file_path = os.path.join(input_directory, filename)
+        if os.path.isfile(file_path) and filename.endswith(".json"):
+            with open(file_path, "rb") as f:
+                writer.add(orjson.loads(f.read()))
+    writer.close()
+    if output_directory == SHARD_DIR:
+        set_corpus_path(SHARD_DIR)
+    print(f"Wrote {writer.documents} documents to {writer.next_shard} shards in {output_directory}")
+
+
+def info(path):
+    documents = sum(1 for _ in read_documents(path, sections=()))
+    sizes = [os.path.getsize(p) for suffix in (".docs", ".anchors") for p in shard_files(path, suffix)]
+    print(f"{documents} documents in {len(shard_files(path, '.docs'))} shards, {sum(sizes)} bytes")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Append-only shard files of processed documents")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert_parser = commands.add_parser("convert", help="convert a directory of processed JSON files")
+    convert_parser.add_argument("input_directory", nargs="?", default=PROCESSED_FILES_DIR)
+    convert_parser.add_argument("--output", default=SHARD_DIR)
+    convert_parser.add_argument("--term-ids", action="store_true", help="store token streams as term ids")
+    info_parser = commands.add_parser("info", help="count the documents and bytes of a shard directory")
+    info_parser.add_argument("path", nargs="?", default=SHARD_DIR)
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        convert(args.input_directory, args.output, term_ids=args.term_ids)
+    else:
+        info(args.path)
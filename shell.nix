@@ -5,7 +5,6 @@ with pkgs; mkShell rec {
   buildInputs = with python312Packages; [
     python312
     numpy
-    networkx
     lxml
     tqdm
     typing-extensions
@@ -1,12 +1,26 @@
+import argparse
 import threading
+import hashlib
 from rocksdict import Rdict
 import simhash
 
+FINGERPRINT_BITS = 64
+MAX_DISTANCE = 2
+BANDS_VERSION = 1
+DB_PATH = "./data/fingerprints"
+
+
+def reset_store(db_path=DB_PATH):
+    """Delete a fingerprint store and its band tables, so the next page_processor.py run starts empty."""
+    Rdict.destroy(db_path)
+    Rdict.destroy(db_path + "_bands")
+
+
 class SimhashManager:
     _shared_state = {}  # Borg shared state
     _lock = threading.Lock()
 
-    def __init__(self, db_path="./data/fingerprints"):
+    def __init__(self, db_path=DB_PATH):
         self.__dict__ = self._shared_state
         if not hasattr(self, "initialized"):
             with self._lock:
@@ -16,39 +30,94 @@ class SimhashManager:
 
     def _init_db(self, db_path):
         self.db_path = db_path
+        self.bands_path = db_path + "_bands"
         self.db = Rdict(self.db_path)
+        self.bands = Rdict(self.bands_path)
         self.db_lock = threading.Lock()
         self.counter = 0
+        self.band_masks = self._make_band_masks()
+
+        if self.bands.get("__version__") != BANDS_VERSION:
+            self._check_old_store()
+
+    def _make_band_masks(self):
+        # Two fingerprints within MAX_DISTANCE bits differ in at most
+        # MAX_DISTANCE of these MAX_DISTANCE + 1 bands, so they agree exactly
+        # on at least one band and land in a shared bucket.
+        num_bands = MAX_DISTANCE + 1
+        widths = [FINGERPRINT_BITS // num_bands + (i < FINGERPRINT_BITS % num_bands) for i in range(num_bands)]
+        masks = []
+        shift = 0
+        for width in widths:
+            masks.append((shift, (1 << width) - 1))
+            shift += width
+        return masks
+
+    def _band_keys(self, fingerprint):
+        return [f"{band}:{(fingerprint >> shift) & mask}" for band, (shift, mask) in enumerate(self.band_masks)]
+
+    def _add_to_bands(self, url, fingerprint):
+        for key in self._band_keys(fingerprint):
+            bucket = self.bands.get(key, [])
+            bucket.append((url, fingerprint))
+            self.bands[key] = bucket
+
+    def _check_old_store(self):
+        # A store without band tables was written when tokens were hashed with
+        # the salted built-in hash(); its fingerprints cannot be compared with
+        # blake2b ones, and the pages are not kept to recompute them.
+        if next(iter(self.db.keys()), None) is not None:
+            self.close()
+            raise ValueError(f"{self.db_path} holds fingerprints from before the stable token hash. "
+                             f"Delete it with 'python simhashdb.py --reset' and rerun page_processor.py "
+                             f"on the whole crawl to rebuild it")
+        self.bands["__version__"] = BANDS_VERSION
 
     def close(self):
         self.db.close()
+        self.bands.close()
 
     def flush_db(self):
-        self.db.close()
+        self.close()
         self.db = Rdict(self.db_path)
+        self.bands = Rdict(self.bands_path)
 
     def _hash_token_to_int(self, token):
-        return abs(hash(token))
+        # Stable across runs, unlike the salted built-in hash()
+        return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
 
-    def _get_fingerprint(self, content):
+    def get_fingerprint(self, content):
         tokens = content.split()
         tokens = [self._hash_token_to_int(token) for token in tokens]
         return simhash.compute(tokens)
 
     def exists_duplicate(self, url, new_content):
-        new_finger_print = self._get_fingerprint(new_content)
-        
-        with self.db_lock: 
-            for current_url, current_fingerprint in self.db.items():
-                distance = simhash.num_differing_bits(new_finger_print, current_fingerprint)
-                if distance <= 2:
-                    print(f"Duplicate page: {url} matched with URL: {current_url}, {distance}")
-                    return True
+        return self.exists_duplicate_fingerprint(url, self.get_fingerprint(new_content))
+
+    def exists_duplicate_fingerprint(self, url, new_finger_print):
+        with self.db_lock:
+            for key in self._band_keys(new_finger_print):
+                for current_url, current_fingerprint in self.bands.get(key, []):
+                    distance = simhash.num_differing_bits(new_finger_print, current_fingerprint)
+                    if distance <= MAX_DISTANCE:
+                        print(f"Duplicate page: {url} matched with URL: {current_url}, {distance}")
+                        return True
 
             self.db[url] = new_finger_print
+            self._add_to_bands(url, new_finger_print)
             self.counter += 1
 
             if self.counter % 1000 == 0:
                 self.flush_db()
-            
-        return False
\ No newline at end of file
+
+        return False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Near-duplicate fingerprint store of page_processor.py")
+    parser.add_argument('--reset', action='store_true', help='delete the store and its band tables')
+    args = parser.parse_args()
+
+    if args.reset:
+        reset_store()
+        print(f"Deleted {DB_PATH} and its band tables")
@@ -0,0 +1,137 @@
+import os
+import mmap
+import struct
+from array import array
+from pathlib import Path
+
+import numpy as np
+import orjson
+from tqdm import tqdm
+
+from diskdict import DiskDict
+from lexicon import build_lexicon
+from postings import decode_columns
+
+BLOCK_SIZE = 128
+TERM_BOUNDS_PATH = 'data/term_bounds.bin'
+MAGIC = b"TBND"
+VERSION = 1
+
+# Block bounds file layout (all integers little-endian), one entry per term in
+# sorted order, the order of the terms in the lexicon:
+#
+#   header    <4sBxxxQQ                 magic, version, term count, block count
+#   offsets   (term count + 1) * <u8    index of each term's first block
+#   maxima    block count * <f8         largest normalized impact of every block of BLOCK_SIZE postings
+#   last ids  block count * <u4         last doc id of every block
+#
+# The largest impact of a whole list is the max_impact column of the lexicon.
+_HEADER = struct.Struct("<4sBxxxQQ")
+
+
+def term_bounds_path(filename="diskdict"):
+    return TERM_BOUNDS_PATH if filename == "diskdict" else 'data/' + filename + '_term_bounds.bin'
+
+
+def write_term_bounds(db, doc_norms, path):
+    """Write the block bounds of every term of db and return term -> largest impact.
+
+    The impact that matters for pruning is tf-idf / doc_norm, so that is what
+    is maximised, over each block of BLOCK_SIZE postings and over the whole
+    posting list.
+    """
+    max_impacts = {}
+    offsets = array("Q", [0])
+    maxima = array("d")
+    last_doc_ids = array("I")
+    for term in tqdm(sorted(db.disk_index), desc="Computing term bounds"):
+        doc_ids, scores = decode_columns(db.get_bytes(term))
+        normalized = [score / doc_norms[doc_id] if doc_norms[doc_id] else 0.0
+                      for doc_id, score in zip(doc_ids, scores)]
+
+        for start in range(0, len(doc_ids), BLOCK_SIZE):
+            last_doc_ids.append(doc_ids[min(start + BLOCK_SIZE, len(doc_ids)) - 1])
+            maxima.append(max(normalized[start:start + BLOCK_SIZE]))
+        offsets.append(len(maxima))
+        max_impacts[term] = max(maxima[offsets[-2]:], default=0.0)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(offsets) - 1, len(maxima)))
+        f.write(np.asarray(offsets, dtype="<u8").tobytes())
+        f.write(np.asarray(maxima, dtype="<f8").tobytes())
+        f.write(np.asarray(last_doc_ids, dtype="<u4").tobytes())
+    os.replace(tmp_path, path)
+    return max_impacts
+
+
+def build_term_bounds(filename="diskdict"):
+    """Write the block bounds of data/<filename> and return term -> largest impact for its lexicon."""
+    norms = orjson.loads(Path('data/doc_norms.json').read_bytes())
+    doc_norms = [0.0] * len(norms)
+    for doc_id, norm in norms.items():
+        doc_norms[int(doc_id)] = norm
+
+    db = DiskDict(filename, read_only=True)
+    max_impacts = write_term_bounds(db, doc_norms, term_bounds_path(filename))
+    db.close()
+    return max_impacts
+
+
+class BlockBounds:
+    """Memory-mapped block bounds of a DiskDict, found through the ordinals of its lexicon."""
+
+    def __init__(self, path, lexicon):
+        self.lexicon = lexicon
+        with open(path, "rb") as f:
+            self.data_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, num_terms, num_blocks = _HEADER.unpack_from(self.data_map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} term bounds file")
+        if num_terms != lexicon.num_terms:
+            raise ValueError(f"{path} does not match the lexicon {lexicon.path}")
+
+        offset = _HEADER.size
+        self.offsets = np.frombuffer(self.data_map, dtype="<u8", count=num_terms + 1, offset=offset)
+        offset += self.offsets.nbytes
+        self.maxima = np.frombuffer(self.data_map, dtype="<f8", count=num_blocks, offset=offset)
+        offset += self.maxima.nbytes
+        self.last_doc_ids = np.frombuffer(self.data_map, dtype="<u4", count=num_blocks, offset=offset)
+
+    def blocks(self, term):
+        """([last doc id], [block max]) of the blocks of a term's posting list; empty for an unknown term."""
+        ordinal = self.lexicon.ordinal(term)
+        if ordinal < 0:
+            return [], []
+        start, end = int(self.offsets[ordinal]), int(self.offsets[ordinal + 1])
+        return self.last_doc_ids[start:end].tolist(), self.maxima[start:end].tolist()
+
+
+def load_block_bounds(filename, lexicon):
+    """The BlockBounds of data/<filename>, or None without a lexicon or a bounds file written after the index."""
+    path = term_bounds_path(filename)
+    if lexicon is None or not os.path.exists(path):
+        return None
+    if os.path.getmtime(path) < os.path.getmtime("data/" + filename + ".idx"):
+        return None
+    return BlockBounds(path, lexicon)
+
+
+def stored_max_impacts(filename="diskdict"):
+    """term -> largest impact taken from the blocks of the existing bounds file of data/<filename>, or None."""
+    path = term_bounds_path(filename)
+    if not os.path.exists(path):
+        return None
+    terms = sorted(orjson.loads(Path("data/" + filename + ".idx").read_bytes()))
+    data = Path(path).read_bytes()
+    _, _, num_terms, num_blocks = _HEADER.unpack_from(data)
+    if num_terms != len(terms):
+        return None
+    offsets = np.frombuffer(data, dtype="<u8", count=num_terms + 1, offset=_HEADER.size)
+    maxima = np.frombuffer(data, dtype="<f8", count=num_blocks, offset=_HEADER.size + offsets.nbytes)
+    return {term: float(maxima[offsets[i]:offsets[i + 1]].max(initial=0.0)) for i, term in enumerate(terms)}
+
+
+if __name__ == '__main__':
+    build_lexicon("diskdict", build_term_bounds())
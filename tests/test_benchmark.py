@@ -0,0 +1,18 @@
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_benchmark_passes(tmp_path):
+    output = tmp_path / "bench.json"
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, "benchmark.py"), "--docs", "40", "--queries", "30",
+                    "--indexer-args=--single-pass", "--workdir", str(tmp_path / "work"), "--output", str(output)],
+                   check=True, capture_output=True)
+    search = json.loads(output.read_bytes())["stages"]["search"]
+
+    # Only repeated queries within a pass hit the result cache, except in the cached pass
+    assert search["warm"]["result_cache_hits"] == search["cold"]["result_cache_hits"] < 30
+    assert search["cached"]["result_cache_hits"] == 30
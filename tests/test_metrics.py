@@ -0,0 +1,34 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Metrics  # noqa: E402
+
+
+def test_tallies_of_running_and_finished_threads_are_reported():
+    metrics = Metrics()
+    release = threading.Event()
+
+    def work(wait):
+        for _ in range(1000):
+            metrics.tally("bytes_read", 3)
+        if wait:
+            release.wait()
+
+    finished = [threading.Thread(target=work, args=(False,)) for _ in range(4)]
+    running = [threading.Thread(target=work, args=(True,)) for _ in range(4)]
+    for thread in finished + running:
+        thread.start()
+    for thread in finished:
+        thread.join()
+    metrics.tally("bytes_read")
+
+    assert metrics.snapshot()["counters"]["bytes_read"] == 8 * 3000 + 1
+    release.set()
+    for thread in running:
+        thread.join()
+    # The finished threads' tallies move into the shared counters; only this thread's stay apart
+    assert metrics.snapshot()["counters"]["bytes_read"] == 8 * 3000 + 1
+    assert len(metrics.thread_counters) == 1
@@ -0,0 +1,144 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from benchmark import generate_corpus  # noqa: E402
+
+
+def run(workdir, *args):
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, args[0]), *args[1:]],
+                   cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+
+def run_python(workdir, code):
+    """Run code in a fresh interpreter inside workdir (the modules load data/ on import) and return its JSON output."""
+    process = subprocess.run([sys.executable, "-c", f"import sys; sys.path.insert(0, {REPO_DIR!r})\n" + code],
+                             cwd=workdir, capture_output=True, text=True)
+    assert process.returncode == 0, process.stderr
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+@pytest.fixture(scope="module")
+def index_dir(tmp_path_factory):
+    """A small positional index built end to end from a synthetic crawl."""
+    workdir = tmp_path_factory.mktemp("index")
+    os.makedirs(workdir / "data")
+    generate_corpus(str(workdir / "raw"), 60)
+    run(workdir, "page_processor.py", str(workdir / "raw"))
+    run(workdir, "indexer.py", "--positions")
+    run(workdir, "pagerank.py")
+    return workdir
+
+
+def test_search_without_query(index_dir):
+    response = run_python(index_dir, """
+import json, server
+response = server.app.test_client().get('/search')
+print(json.dumps([response.status_code, response.get_json()['urls']]))
+""")
+    assert response == [200, []]
+
+
+def test_page_rank_update_reloads_index(index_dir, tmp_path):
+    workdir = tmp_path / "index"
+    shutil.copytree(index_dir, workdir)
+    changed = run_python(workdir, """
+import json
+import query_processor as qp
+from doctable import update_page_ranks
+
+qp.result_cache.check_interval = 0
+df = qp.db.lexicon.entries["df"]
+term = qp.db.lexicon.term(int(abs(df - len(qp.doc_table) // 2).argmin()))
+doc_ids = qp.db.get_arrays(term)[0].tolist()
+before = qp.search(term, top_k=3)
+
+# Give a matching document outside the top 3 the only high PageRank
+boosted = next(doc_id for doc_id in doc_ids if doc_id not in {result[1] for result in before})
+update_page_ranks({doc_id: 1e-6 for doc_id in range(len(qp.doc_table))} | {boosted: 1.0})
+qp.search(term, top_k=3)  # sees the change, waits for it to settle
+after = qp.search(term, top_k=3)
+print(json.dumps([before[0][1], after[0][1], boosted, qp.max_page_rank, qp.result_cache.invalidations]))
+""")
+    before_top, after_top, boosted, max_page_rank, invalidations = changed
+    assert before_top != boosted
+    assert after_top == boosted
+    assert max_page_rank == 1.0
+    assert invalidations == 1
+
+
+def test_phrase_order_in_segments(index_dir, tmp_path):
+    workdir = tmp_path / "index"
+    shutil.copytree(index_dir, workdir)
+    new_pages = workdir / "new_pages"
+    os.makedirs(new_pages)
+    pages = {"ordered": ["zorb", "quark"], "gapped": ["zorb", "blip", "quark"], "reversed": ["quark", "zorb"]}
+    for name, text in pages.items():
+        (new_pages / f"{name}.json").write_bytes(json.dumps({"url": f"https://example.com/{name}", "other_text": text}).encode())
+    run(workdir, "segments.py", "add", "--no-merge", str(new_pages))
+    run(workdir, "segments.py", "add", "--no-merge", str(new_pages))
+    run(workdir, "segments.py", "merge", "--all")
+
+    matches = run_python(workdir, """
+import json
+import query_processor as qp
+print(json.dumps([sorted(url for _, _, url in qp.search(query)) for query in ['"zorb quark"', '"zorb quark"~1', 'zorb quark']]))
+""")
+    assert matches == [["https://example.com/ordered"],
+                       ["https://example.com/gapped", "https://example.com/ordered"],
+                       ["https://example.com/gapped", "https://example.com/ordered", "https://example.com/reversed"]]
+
+
+def test_segment_base_norms_drift(index_dir, tmp_path):
+    # Base documents keep their build-time norms when segments shift the IDF;
+    # with a tenth of the documents in a segment the drift stays small
+    workdir = tmp_path / "index"
+    shutil.copytree(index_dir, workdir)
+    processed_dir = workdir / "data" / "processed_files"
+    new_pages = workdir / "new_pages"
+    os.makedirs(new_pages)
+    for name in sorted(os.listdir(processed_dir))[-6:]:
+        shutil.move(processed_dir / name, new_pages / name)
+    run(workdir, "indexer.py")
+    run(workdir, "pagerank.py")
+    run(workdir, "segments.py", "add", "--no-merge", str(new_pages))
+
+    max_error, mean_error = run_python(workdir, """
+import json
+import numpy as np
+import query_processor as qp
+
+base = qp.segmented.indexes[0]
+exact = np.zeros(qp.segmented.base_docs)
+for term in qp.db.lexicon:
+    doc_ids, scores = base.get_arrays(term)
+    exact[doc_ids] += scores ** 2
+exact = np.sqrt(exact)
+indexed = exact > 0
+error = np.abs(qp.segmented.norms[:len(exact)][indexed] / exact[indexed] - 1)
+print(json.dumps([float(error.max()), float(error.mean())]))
+""")
+    assert max_error < 0.15
+    assert mean_error < 0.05
+
+
+def test_tier_report_in_metrics(index_dir, tmp_path):
+    workdir = tmp_path / "index"
+    shutil.copytree(index_dir, workdir)
+    run(workdir, "tiers.py")
+    counters = run_python(workdir, """
+import json, server
+client = server.app.test_client()
+for query in ['page', 'zorb']:
+    client.get('/search', query_string={'q': query})
+print(json.dumps(client.get('/metrics?format=json').get_json()['counters']))
+""")
+    assert counters["tier1_answered"] + counters["tier2_answered"] == 2
+    assert counters["tier1_ratio"] == counters["tier1_answered"] / 2
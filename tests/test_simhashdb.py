@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+from rocksdict import Rdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simhashdb import SimhashManager, reset_store  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_manager(monkeypatch):
+    monkeypatch.setattr(SimhashManager, "_shared_state", {})
+
+
+def test_old_store_is_refused_until_reset(tmp_path):
+    db_path = str(tmp_path / "fingerprints")
+    old = Rdict(db_path)
+    old["https://example.com/page"] = 12345  # written before the band tables existed
+    old.close()
+
+    with pytest.raises(ValueError, match="simhashdb.py --reset"):
+        SimhashManager(db_path)
+
+    reset_store(db_path)
+    manager = SimhashManager(db_path)
+    assert not manager.exists_duplicate("https://example.com/page", "some page text")
+    manager.close()
+
+
+def test_new_store_keeps_its_fingerprints(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "fingerprints")
+    manager = SimhashManager(db_path)
+    assert not manager.exists_duplicate("https://example.com/a", "the same page text")
+    manager.close()
+
+    monkeypatch.setattr(SimhashManager, "_shared_state", {})
+    manager = SimhashManager(db_path)
+    assert manager.exists_duplicate("https://example.com/b", "the same page text")
+    manager.close()
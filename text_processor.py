@@ -1,15 +1,79 @@
+import os
 import re
+from pathlib import Path
+
+import orjson
 from nltk.stem import PorterStemmer, SnowballStemmer
 
+TOKEN_PATTERN = re.compile(r"[a-zA-Z0-9]+")
+STEM_TABLE_PATH = 'data/stem_table.json'
+MAX_MEMO_ENTRIES = 200000
+
+
+class Analyzer:
+    """Tokenizer and a shared Snowball stemmer with a memo of surface form -> stem.
+
+    Word frequencies are heavily skewed, so most tokens are stemmed once and
+    then looked up. The memo stops growing at max_entries; words past that
+    are still stemmed, just not remembered. Entries learned since the last
+    drain_new() are tracked so forked workers can hand them back.
+    """
+
+    def __init__(self, max_entries=MAX_MEMO_ENTRIES):
+        self.stemmer = SnowballStemmer('english')
+        self.max_entries = max_entries
+        self.memo = {}
+        self.new_entries = {}
+
+    def stem(self, word):
+        stem = self.memo.get(word)
+        if stem is None:
+            stem = self.stemmer.stem(word)
+            if len(self.memo) < self.max_entries:
+                self.memo[word] = stem
+                self.new_entries[word] = stem
+        return stem
+
+    def stem_words(self, words):
+        memo = self.memo
+        return [memo[word] if word in memo else self.stem(word) for word in words]
+
+    def analyze(self, text):
+        return self.stem_words(tokenize(text))
+
+    def analyze_texts(self, texts):
+        """Tokens of all texts stemmed in one batch, in order."""
+        return self.stem_words([word.lower() for word in TOKEN_PATTERN.findall(" ".join(texts))])
+
+    def update(self, entries):
+        for word, stem in entries.items():
+            if len(self.memo) >= self.max_entries:
+                break
+            self.memo.setdefault(word, stem)
+
+    def drain_new(self):
+        entries, self.new_entries = self.new_entries, {}
+        return entries
+
+    def save(self, path=STEM_TABLE_PATH):
+        Path(path).write_bytes(orjson.dumps(self.memo))
+
+    def load(self, path=STEM_TABLE_PATH):
+        if os.path.exists(path):
+            self.update(orjson.loads(Path(path).read_bytes()))
+
+
+analyzer = Analyzer()
+
+
 def tokenize(text):
     if text is None:
         return []
-    return [word.lower() for word in re.findall(r"[a-zA-Z0-9]+", text)]
+    return [word.lower() for word in TOKEN_PATTERN.findall(text)]
 
 
 def stem_words(words):
-    stemmer = SnowballStemmer('english')
-    return [stemmer.stem(word) for word in words]
+    return analyzer.stem_words(words)
 
 
 if __name__ == '__main__':
@@ -21,4 +85,4 @@ if __name__ == '__main__':
 
     words = tokenize(text_2)
     stemmed_words = stem_words(words)
-    print(stemmed_words)
\ No newline at end of file
+    print(stemmed_words)
@@ -0,0 +1,58 @@
+import argparse
+import heapq
+
+import numpy as np
+from tqdm import tqdm
+
+from diskdict import DiskDict
+from index_builder import IndexBuilder
+from postings import decode_columns
+from doctable import DocTable
+from lexicon import build_lexicon
+
+TIER_FILENAMES = ["diskdict_tier1", "diskdict_tier2"]
+CHAMPION_SIZE = 500  # highest-impact postings of every term kept in tier 1
+PAGE_RANK_TIER_DOCS = 15000  # documents with the highest PageRank kept in tier 1
+
+
+def build_tiers(champion_size=CHAMPION_SIZE, page_rank_docs=PAGE_RANK_TIER_DOCS):
+    """Split every posting list into a champion tier and a tail tier.
+
+    A posting goes to tier 1 if its document is among the page_rank_docs
+    highest-PageRank documents or among the term's champion_size highest
+    impacts, and to tier 2 otherwise. Documents with a PageRank of 0 are never
+    ranked by search, so they are left out of both tiers.
+    """
+    page_ranks = DocTable().page_ranks
+    ranked_docs = np.argsort(-page_ranks, kind="stable")[:page_rank_docs]
+    top_docs = {int(doc_id) for doc_id in ranked_docs if page_ranks[doc_id] > 0}
+
+    db = DiskDict(read_only=True)
+    tiers = [IndexBuilder(filename) for filename in TIER_FILENAMES]
+    tier_sizes = [0, 0]
+
+    for term in tqdm(db.disk_index, desc="Building tiers"):
+        doc_ids, scores = decode_columns(db.get_bytes(term))
+        live = [(doc_id, score) for doc_id, score in zip(doc_ids, scores) if page_ranks[doc_id] > 0]
+        champions = {doc_id for doc_id, _ in heapq.nlargest(champion_size, live, key=lambda posting: posting[1])}
+
+        for doc_id, score in live:
+            tier = 0 if doc_id in champions or doc_id in top_docs else 1
+            tiers[tier].put(term, doc_id, score)
+            tier_sizes[tier] += 1
+
+    db.close()
+    for tier, filename in zip(tiers, TIER_FILENAMES):
+        tier.close()
+        build_lexicon(filename)
+
+    print(f"Tier 1 postings: {tier_sizes[0]}, tier 2 postings: {tier_sizes[1]}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--champion-size', type=int, default=CHAMPION_SIZE)
+    parser.add_argument('--page-rank-docs', type=int, default=PAGE_RANK_TIER_DOCS)
+    args = parser.parse_args()
+
+    build_tiers(args.champion_size, args.page_rank_docs)
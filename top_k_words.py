@@ -1,24 +1,48 @@
 import heapq
+import numpy as np
 from diskdict import DiskDict
+from postings import posting_count
+from completion import document_frequencies as summed_document_frequencies
+from index_shards import shard_count, shard_filename
 
 top_n_heap = []
-db = DiskDict()
+shards = shard_count()
+db = DiskDict(read_only=True) if not shards else None
 top_k = 5000
 
-unique_words = set()
 
-for word in db.disk_index.keys():
-    unique_words.add(word)
-    postings = db.get(word)
-    count = len(postings)
-    
+def document_frequencies():
+    if shards:
+        # Index shards hold disjoint documents, so a term's df is the sum over them
+        dbs = [DiskDict(shard_filename(shard), read_only=True) for shard in range(shards)]
+        df = summed_document_frequencies(dbs, min_df=1)
+        for shard_db in dbs:
+            shard_db.close()
+        print(len(df))
+        yield from df.items()
+        return
+
+    print(len(db.disk_index))
+    if db.lexicon:
+        # df is stored in the lexicon, so only the terms that can make the top k are looked at,
+        # in the same sorted order as the index
+        df = db.lexicon.entries["df"]
+        kth = np.partition(df, -top_k)[-top_k] if len(df) > top_k else 0
+        for ordinal in np.flatnonzero(df >= kth).tolist():
+            yield db.lexicon.term(ordinal), int(df[ordinal])
+        return
+
+    for word in db.disk_index.keys():
+        yield word, posting_count(db.get_bytes(word))
+
+
+for word, count in document_frequencies():
     if len(top_n_heap) < top_k:
         heapq.heappush(top_n_heap, (count, word))
     elif count > top_n_heap[0][0]:
         heapq.heapreplace(top_n_heap, (count, word))
 
 top_words = [word for _, word in sorted(top_n_heap, reverse=True)]
-print(len(unique_words))
 
 with open("data/top_k_words.txt", "w") as f:
     for word in top_words: